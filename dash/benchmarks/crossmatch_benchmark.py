@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark the multi-target crossmatch of stage 08 on synthetic catalogs.
+
+Compares crossmatching a catalog with each right catalog in turn (lsdb's
+crossmatch, then to_association), as 08 used to, with
+multi_crossmatch.crossmatch_associations, and checks that both write
+associations with the same rows. One right catalog is partitioned more
+finely than the left catalog and the other more coarsely, and both have
+margins.
+
+Usage (from the dash directory):
+
+    python benchmarks/crossmatch_benchmark.py --left-rows 200000 --right-rows 300000
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import lsdb
+import numpy as np
+import pandas as pd
+from lsdb.io.to_association import to_association
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from multi_crossmatch import (  # noqa: E402
+    SEPARATION_COLUMN,
+    CrossmatchTarget,
+    crossmatch_associations,
+)
+
+# name: (identifier, suffix, lowest order, rows per partition, scatter in arcsec)
+RIGHT_CATALOGS = {
+    "fine": ("objectid", "_fine", 3, 3_000, 0.3),
+    "coarse": ("objID", "_coarse", 1, 40_000, 1.0),
+}
+
+
+def write_catalogs(base_dir, left_rows, right_rows, seed=1):
+    """A left catalog, and right catalogs with noisy copies of its positions."""
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(30, 90, left_rows)
+    dec = rng.uniform(-60, -10, left_rows)
+    lsdb.from_dataframe(
+        pd.DataFrame({"lid": np.arange(left_rows), "ra": ra, "dec": dec}),
+        catalog_name="left",
+        lowest_order=2,
+        highest_order=6,
+        partition_rows=8_000,
+    ).to_hats(base_dir / "left")
+    for k, (name, (id_column, _, order, rows, scatter)) in enumerate(
+        RIGHT_CATALOGS.items()
+    ):
+        source = rng.integers(0, left_rows, right_rows)
+        offsets = rng.normal(scale=scatter / 3600, size=(2, right_rows))
+        lsdb.from_dataframe(
+            pd.DataFrame(
+                {
+                    id_column: np.arange(right_rows) * 7 + k,
+                    "ra": ra[source] + offsets[0],
+                    "dec": np.clip(dec[source] + offsets[1], -90, 90),
+                }
+            ),
+            catalog_name=name,
+            lowest_order=order,
+            highest_order=7,
+            partition_rows=rows,
+            margin_threshold=5,
+        ).to_hats(base_dir / name)
+
+
+def crossmatch_each(left, base_dir, output_dir, radius_arcsec, n_neighbors):
+    """The previous implementation, for comparison."""
+    for name, (id_column, suffix, *_) in RIGHT_CATALOGS.items():
+        right = lsdb.open_catalog(base_dir / name)
+        matches = left.crossmatch(
+            right,
+            radius_arcsec=radius_arcsec,
+            n_neighbors=n_neighbors,
+            suffixes=("", suffix),
+        )
+        to_association(
+            matches[["lid", id_column + suffix, SEPARATION_COLUMN]],
+            catalog_name=f"left_x_{name}",
+            base_catalog_path=output_dir / name,
+            primary_catalog_dir=base_dir / "left",
+            primary_column_association="lid",
+            primary_id_column="lid",
+            join_catalog_dir=base_dir / name,
+            join_column_association=id_column + suffix,
+            join_id_column=id_column,
+        )
+
+
+def same_rows(previous_dir, current_dir, association_column):
+    key = ["lid", association_column]
+    previous = lsdb.open_catalog(previous_dir).compute().reset_index()
+    current = lsdb.open_catalog(current_dir).compute().reset_index()
+    previous = previous.sort_values(key).reset_index(drop=True)
+    current = current.sort_values(key).reset_index(drop=True)
+    return (
+        len(previous) == len(current)
+        and previous[key].equals(current[key])
+        and np.allclose(
+            previous[SEPARATION_COLUMN].astype(float),
+            current[SEPARATION_COLUMN].astype(float),
+            atol=1e-6,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark crossmatching a catalog with several catalogs at once.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--left-rows", type=int, default=200_000, help="Rows of the left catalog"
+    )
+    parser.add_argument(
+        "--right-rows", type=int, default=300_000, help="Rows of each right catalog"
+    )
+    parser.add_argument("--radius", type=float, default=1.0, help="Radius in arcsec")
+    parser.add_argument(
+        "--n-neighbors", type=int, default=3, help="Matches per left object"
+    )
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_dir = Path(tmp_dir)
+        write_catalogs(base_dir, args.left_rows, args.right_rows)
+        left = lsdb.open_catalog(base_dir / "left")
+
+        start_time = time.perf_counter()
+        crossmatch_each(
+            left, base_dir, base_dir / "previous", args.radius, args.n_neighbors
+        )
+        previous_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        targets = [
+            CrossmatchTarget(
+                name, lsdb.open_catalog(base_dir / name), id_column, suffix
+            )
+            for name, (id_column, suffix, *_) in RIGHT_CATALOGS.items()
+        ]
+        crossmatch_associations(
+            left,
+            targets,
+            left_id_column="lid",
+            left_catalog_dir=base_dir / "left",
+            radius_arcsec=args.radius,
+            n_neighbors=args.n_neighbors,
+        )
+        current_time = time.perf_counter() - start_time
+
+        same = all(
+            same_rows(
+                base_dir / "previous" / target.name,
+                base_dir / "left" / f"left_x_{target.name}",
+                target.association_column,
+            )
+            for target in targets
+        )
+    print(
+        pd.DataFrame(
+            {"seconds": [previous_time, current_time]},
+            index=["crossmatch + to_association per target", "multi-target"],
+        ).to_string(float_format=lambda x: f"{x:,.2f}")
+    )
+    print(f"Speedup: {previous_time / current_time:.1f}x, same associations: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of DimensionParquetReader on synthetic parquet files.
+
+Compares the previous reader (whole files read one after the other,
+np.full per batch and column, pa.concat_tables of small tables) with the
+current reader, for each dimension encoding. Every variant runs in a fresh
+process, so that its peak RSS can be measured in isolation.
+
+Usage (from the dash directory):
+
+    python benchmarks/dimension_reader_benchmark.py --files 16 --rows 2000000
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from dimension_reader import DimensionParquetReader  # noqa: E402
+from lsst.resources import ResourcePath  # noqa: E402
+
+
+class LegacyDimensionParquetReader(DimensionParquetReader):
+    """The reader before this series, for comparison: every file is opened
+    whole and decoded before the next one is opened, dimension columns are
+    built with np.full per batch and column, and small tables are
+    concatenated."""
+
+    def read(self, input_file, read_columns=None):
+        columns = read_columns or self.column_names
+        batch_files = pd.read_csv(input_file)
+        added_columns = set(batch_files.columns) - set(["path"])
+
+        batch_size = 0
+        batch_tables = []
+
+        for _, row in batch_files.iterrows():
+            with ResourcePath(row["path"]).open("rb") as f:
+                parquet_file = pq.ParquetFile(f, **self.kwargs)
+                if parquet_file.metadata.num_rows == 0:
+                    continue
+                for smaller_table in parquet_file.iter_batches(
+                    batch_size=self.chunksize, columns=columns
+                ):
+                    table = pa.Table.from_batches([smaller_table])
+                    table = table.replace_schema_metadata()
+                    if read_columns is None:
+                        for column in added_columns:
+                            if column not in table.column_names:
+                                table = table.append_column(
+                                    column,
+                                    [np.full(len(table), fill_value=row[column])],
+                                )
+                    if batch_size + len(table) >= self.chunksize:
+                        if len(batch_tables) == 0:
+                            yield table
+                            batch_size = 0
+                        else:
+                            yield pa.concat_tables(batch_tables)
+                            batch_tables = []
+                            batch_tables.append(table)
+                            batch_size = len(table)
+                    else:
+                        batch_tables.append(table)
+                        batch_size += len(table)
+
+        if len(batch_tables) > 0:
+            yield pa.concat_tables(batch_tables)
+
+
+VARIANTS = {
+    "legacy": (LegacyDimensionParquetReader, {}),
+    "plain": (DimensionParquetReader, {"dimension_encoding": "plain"}),
+    "dictionary": (DimensionParquetReader, {"dimension_encoding": "dictionary"}),
+    "run_end": (DimensionParquetReader, {"dimension_encoding": "run_end"}),
+}
+
+
+def write_synthetic_files(directory, num_files, num_rows, row_group_size, seed=42):
+    """Write parquet files of varying sizes, and an index file listing them
+    with tract, patch, band and visit dimensions."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for index in range(num_files):
+        file_rows = int(num_rows * rng.uniform(0.5, 1.5))
+        table = pa.table(
+            {
+                "id": np.arange(file_rows, dtype=np.int64),
+                "ra": rng.uniform(0, 360, file_rows),
+                "dec": rng.uniform(-90, 90, file_rows),
+                "flux": rng.normal(size=file_rows).astype(np.float32),
+                "fluxErr": rng.uniform(size=file_rows).astype(np.float32),
+            }
+        )
+        path = Path(directory) / f"part_{index:04d}.parquet"
+        pq.write_table(table, path, row_group_size=row_group_size)
+        rows.append(
+            {
+                "tract": 10_000 + index // 4,
+                "patch": index % 100,
+                "band": "ugrizy"[index % 6],
+                "visit": 2025_0417_00000 + index,
+                "path": str(path),
+            }
+        )
+    index_file = Path(directory) / "index.csv"
+    pd.DataFrame(rows).to_csv(index_file, index=False)
+    return index_file
+
+
+def run_variant(variant, index_file, chunksize):
+    """Consume all tables of one reader variant; runs in its own process."""
+    reader_class, kwargs = VARIANTS[variant]
+    reader = reader_class(chunksize=chunksize, prefetch=0, **kwargs)
+    num_rows = 0
+    num_tables = 0
+    largest_table = 0
+    start_time = time.perf_counter()
+    for table in reader.read(index_file):
+        num_rows += len(table)
+        num_tables += 1
+        largest_table = max(largest_table, len(table))
+    elapsed = time.perf_counter() - start_time
+    return {
+        "variant": variant,
+        "rows": num_rows,
+        "tables": num_tables,
+        "largest_table": largest_table,
+        "seconds": elapsed,
+        "rows_per_second": num_rows / elapsed,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark DimensionParquetReader on synthetic parquet.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--files", type=int, default=16, help="Number of files")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows per file")
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant")
+    parser.add_argument(
+        "--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS)
+    )
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = write_synthetic_files(
+            directory, args.files, args.rows, args.row_group_size
+        )
+        results = []
+        for _ in range(args.repeat):
+            for variant in args.variants:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results.append(
+                        executor.submit(
+                            run_variant, variant, index_file, args.chunksize
+                        ).result()
+                    )
+
+    summary = (
+        pd.DataFrame(results)
+        .groupby("variant", sort=False)
+        .agg(
+            rows=("rows", "first"),
+            tables=("tables", "first"),
+            largest_table=("largest_table", "max"),
+            rows_per_second=("rows_per_second", "median"),
+            peak_rss_mib=("peak_rss_mib", "max"),
+        )
+    )
+    print(summary.to_string(float_format=lambda x: f"{x:,.1f}"))
+
+
+if __name__ == "__main__":
+    main()
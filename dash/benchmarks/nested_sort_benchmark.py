@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark sorting the nested sources of a partition by timestamp.
+
+Compares the flatten / sort / join_nested approach that 05-Nesting used
+with the segmented sort of nesting.sort_nested_sources, on a synthetic
+nested partition, and checks that both give the same light curves.
+
+Usage (from the dash directory):
+
+    python benchmarks/nested_sort_benchmark.py --objects 15000 --sources 400
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import nested_pandas as npd
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from nesting import sort_nested_sources  # noqa: E402
+
+
+def flatten_sort_rejoin(df, source_cols, mjd_col="midpointMjdTai"):
+    """The previous implementation, for comparison."""
+    for source_col in source_cols:
+        flat_sources = df[source_col].nest.to_flat()
+        df = df.drop(columns=[source_col])
+        df = df.join_nested(
+            flat_sources.sort_values([flat_sources.index.name, mjd_col]), source_col
+        )
+    return df
+
+
+def synthetic_partition(num_objects, mean_sources, num_columns, seed=42):
+    """Objects with a forced-source-like nested column, in random time order."""
+    rng = np.random.default_rng(seed)
+    index = pd.Index(
+        np.sort(rng.choice(2**50, num_objects, replace=False)), name="objectId"
+    )
+    objects = npd.NestedFrame(
+        {
+            "ra": rng.uniform(0, 360, num_objects),
+            "dec": rng.uniform(-90, 90, num_objects),
+        },
+        index=index,
+    )
+    lengths = rng.poisson(mean_sources, num_objects)
+    num_sources = lengths.sum()
+    sources = {
+        "midpointMjdTai": rng.uniform(60000, 61000, num_sources),
+        "visit": rng.integers(0, 1_000_000, num_sources),
+        "band": rng.choice(list("ugrizy"), num_sources),
+    }
+    for column in range(num_columns - len(sources)):
+        sources[f"col{column}"] = rng.normal(size=num_sources).astype(np.float32)
+    flat = pd.DataFrame(sources, index=np.repeat(index, lengths))
+    return objects.join_nested(flat, "objectForcedSource")
+
+
+def timed(function, *args, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark sorting nested sources by timestamp.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--objects", type=int, default=15_000, help="Objects per partition"
+    )
+    parser.add_argument(
+        "--sources", type=int, default=400, help="Mean sources per object"
+    )
+    parser.add_argument("--columns", type=int, default=30, help="Nested columns")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per method (best is kept)"
+    )
+    args = parser.parse_args()
+
+    partition = synthetic_partition(args.objects, args.sources, args.columns)
+    num_sources = partition["objectForcedSource"].nest.flat_length
+    print(
+        f"{len(partition)} objects, {num_sources} sources, {args.columns} nested columns"
+    )
+
+    source_cols = ["objectForcedSource"]
+    previous, previous_time = timed(
+        flatten_sort_rejoin, partition, source_cols, repeat=args.repeat
+    )
+    current, current_time = timed(
+        sort_nested_sources, partition, source_cols, repeat=args.repeat
+    )
+
+    same = (
+        previous["objectForcedSource"]
+        .nest.to_flat()
+        .reset_index()
+        .equals(current["objectForcedSource"].nest.to_flat().reset_index())
+    )
+    print(
+        pd.DataFrame(
+            {
+                "seconds": [previous_time, current_time],
+                "sources_per_second": [
+                    num_sources / previous_time,
+                    num_sources / current_time,
+                ],
+            },
+            index=["flatten/sort/join_nested", "segmented sort"],
+        ).to_string(float_format=lambda x: f"{x:,.2f}")
+    )
+    print(f"Speedup: {previous_time / current_time:.1f}x, identical results: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Dask clients of the pipeline stages.
+
+When the stages are run by util/run_stages.py, they all connect to one
+long-lived cluster whose scheduler address is in DASH_SCHEDULER_ADDRESS, so
+that independent stages share its workers. A notebook run on its own starts
+its own local cluster, as before.
+"""
+
+import os
+
+from dask.distributed import Client
+
+SCHEDULER_ADDRESS_VARIABLE = "DASH_SCHEDULER_ADDRESS"
+
+
+def get_client(**cluster_kwargs) -> Client:
+    """Client of the shared cluster if there is one, otherwise of a new local
+    cluster created with the given arguments (e.g. n_workers)."""
+    address = os.environ.get(SCHEDULER_ADDRESS_VARIABLE)
+    if address:
+        return Client(address)
+    return Client(**cluster_kwargs)
@@ -1,17 +1,231 @@
+import io
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
+from footer_scanner import read_footer_bytes
 from hats_import.catalog.file_readers import ParquetReader
 from lsst.resources import ResourcePath
 
+logger = logging.getLogger(__name__)
+
+# Column chunks closer than this are fetched with a single read
+RANGE_COALESCE_GAP = 1024 * 1024
+
+
+class SparseParquetFile(io.RawIOBase):
+    """Read-only file holding only some byte ranges of a parquet file.
+
+    The footer and the column chunks of the selected columns are fetched up
+    front; pyarrow then decodes from memory. A read outside of the fetched
+    ranges means a column was requested that was not fetched, and fails.
+    """
+
+    def __init__(self, size, ranges):
+        self.size = size
+        self.ranges = sorted(ranges)  # [(offset, bytes)]
+        self.starts = [offset for offset, _ in self.ranges]
+        self.position = 0
+
+    @property
+    def nbytes(self):
+        return sum(len(data) for _, data in self.ranges)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        index = np.searchsorted(self.starts, self.position, side="right") - 1
+        if index >= 0:
+            offset, data = self.ranges[index]
+            start = self.position - offset
+            if start + size <= len(data):
+                self.position += size
+                return data[start : start + size]
+        raise OSError(
+            f"Bytes {self.position}-{self.position + size} of the parquet file were not fetched"
+        )
+
+
+def fetch_parquet(path, columns=None):
+    """Fetch the footer and the column chunks of the given columns (all if None)
+    of a parquet file with ranged reads, returning a SparseParquetFile."""
+    resource = ResourcePath(path)
+    file_size = resource.size()
+    with resource.open("rb") as f:
+        footer = read_footer_bytes(f, file_size)
+        metadata = pq.read_metadata(pa.BufferReader(footer))
+        selected = None if columns is None else set(columns)
+
+        chunks = []
+        for rg_index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg_index)
+            for col_index in range(row_group.num_columns):
+                column = row_group.column(col_index)
+                root = column.path_in_schema.split(".")[0]
+                if selected is not None and root not in selected:
+                    continue
+                start = column.data_page_offset
+                if column.has_dictionary_page and column.dictionary_page_offset:
+                    start = min(start, column.dictionary_page_offset)
+                chunks.append((start, start + column.total_compressed_size))
+
+        # Coalesce neighbouring chunks to save on requests
+        merged = []
+        for start, end in sorted(chunks):
+            if merged and start - merged[-1][1] <= RANGE_COALESCE_GAP:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        ranges = [(file_size - len(footer), footer)]
+        for start, end in merged:
+            f.seek(start)
+            ranges.append((start, f.read(end - start)))
+    return SparseParquetFile(file_size, ranges)
+
+
+def constant_array(value, length, encoding="plain"):
+    """An array of ``length`` copies of ``value``.
+
+    ``plain`` materializes the values, ``dictionary`` holds a single dictionary
+    entry with all-zero indices, and ``run_end`` a single run.
+    """
+    if encoding == "plain":
+        return pa.array(np.full(length, fill_value=value))
+    if encoding == "dictionary":
+        return pa.DictionaryArray.from_arrays(
+            pa.array(np.zeros(length, dtype=np.int32)), pa.array([value])
+        )
+    if encoding == "run_end":
+        return pa.RunEndEncodedArray.from_arrays(
+            pa.array([length], type=pa.int32()), pa.array([value])
+        )
+    raise ValueError(f"Unknown dimension encoding {encoding!r}")
+
+
+def pop_rows(pending, num_rows):
+    """Pop exactly num_rows rows (or all, if fewer) off the front of a deque of
+    record batches, slicing the last batch taken. Slices share the buffers of
+    the decoded batches, so no data is copied."""
+    batches = []
+    while num_rows > 0 and pending:
+        batch = pending.popleft()
+        if len(batch) > num_rows:
+            pending.appendleft(batch.slice(num_rows))
+            batch = batch.slice(0, num_rows)
+        batches.append(batch)
+        num_rows -= len(batch)
+    return pa.Table.from_batches(batches)
+
 
 class DimensionParquetReader(ParquetReader):
+    """Read the parquet files listed in an index file, adding dimension columns.
+
+    With ``prefetch > 0``, the next ``prefetch`` files are fetched by
+    background threads while the current one is being decoded. Only the
+    column chunks of the requested columns are ever read. Per-file fetch,
+    wait and decode times of the last ``read`` are kept in ``timings``.
+
+    Tables of exactly ``chunksize`` rows are yielded (the last one may be
+    smaller), made of slices of the decoded batches. Dimension columns are
+    sliced from one constant array per column and value, built with
+    ``dimension_encoding`` (see ``constant_array``). The default ``plain``
+    keeps the column types of the catalog schemas; ``dictionary`` and
+    ``run_end`` use next to no memory, but change the column types.
+    """
 
-    def __init__(self, chunksize=500_000, column_names=None, **kwargs):
+    def __init__(
+        self,
+        chunksize=500_000,
+        column_names=None,
+        prefetch=2,
+        dimension_encoding="plain",
+        **kwargs,
+    ):
         self.chunksize = chunksize
         self.column_names = column_names
+        self.prefetch = prefetch
+        self.dimension_encoding = dimension_encoding
         self.kwargs = kwargs
+        self.timings = []
+        self._constants = {}  # column -> (value, array)
+
+    def _dimension_column(self, column, value, length):
+        """A constant column of the given length, sliced from a cached array."""
+        cached = self._constants.get(column)
+        if cached is None or cached[0] != value or len(cached[1]) < length:
+            array = constant_array(
+                value, max(length, self.chunksize), self.dimension_encoding
+            )
+            cached = self._constants[column] = (value, array)
+        return cached[1].slice(0, length)
+
+    def _add_dimensions(self, batch, row, added_columns):
+        schema = batch.schema.remove_metadata()
+        arrays = batch.columns
+        for column in added_columns:
+            if column not in schema.names:
+                array = self._dimension_column(column, row[column], len(batch))
+                schema = schema.append(pa.field(column, array.type))
+                arrays.append(array)
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def _fetch(self, path, columns):
+        start_time = time.perf_counter()
+        sparse_file = fetch_parquet(path, columns)
+        return sparse_file, time.perf_counter() - start_time
+
+    def _fetched_files(self, paths, columns):
+        """Yield (path, sparse file, fetch seconds, wait seconds), in order."""
+        if self.prefetch <= 0:
+            for path in paths:
+                sparse_file, fetch_time = self._fetch(path, columns)
+                yield path, sparse_file, fetch_time, fetch_time
+            return
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            futures = [
+                executor.submit(self._fetch, path, columns)
+                for path in paths[: self.prefetch]
+            ]
+            try:
+                for index, path in enumerate(paths):
+                    if index + self.prefetch < len(paths):
+                        futures.append(
+                            executor.submit(
+                                self._fetch, paths[index + self.prefetch], columns
+                            )
+                        )
+                    start_time = time.perf_counter()
+                    sparse_file, fetch_time = futures[index].result()
+                    futures[index] = None
+                    yield path, sparse_file, fetch_time, time.perf_counter() - start_time
+            finally:
+                for future in futures:
+                    if future is not None:
+                        future.cancel()
 
     def read(self, input_file, read_columns=None):
         self.regular_file_exists(input_file, **self.kwargs)
@@ -20,44 +234,56 @@ class DimensionParquetReader(ParquetReader):
 
         batch_files = pd.read_csv(input_file)
         added_columns = set(batch_files.columns) - set(["path"])
+        self.timings = []
 
-        batch_size = 0
-        batch_tables = []
+        pending = deque()
+        pending_rows = 0
 
-        for _, row in batch_files.iterrows():
-            with ResourcePath(row["path"]).open("rb") as f:
-                parquet_file = pq.ParquetFile(f, **self.kwargs)
-                # ### Do not attempt to process empty files
-                if parquet_file.metadata.num_rows == 0:
-                    continue
-                # ### end of patch
-                for smaller_table in parquet_file.iter_batches(
-                    batch_size=self.chunksize, columns=columns
-                ):
-                    table = pa.Table.from_batches([smaller_table])
-                    table = table.replace_schema_metadata()
-
-                    if read_columns is None:
-                        ## splitting stage - add in dimension columns
-                        for column in added_columns:
-                            if column not in table.column_names:
-                                table = table.append_column(
-                                    column,
-                                    [np.full(len(table), fill_value=row[column])],
-                                )
-                    if batch_size + len(table) >= self.chunksize:
-                        # We've hit our chunksize, send the batch off to the task.
-                        if len(batch_tables) == 0:
-                            yield table
-                            batch_size = 0
-                        else:
-                            yield pa.concat_tables(batch_tables)
-                            batch_tables = []
-                            batch_tables.append(table)
-                            batch_size = len(table)
-                    else:
-                        batch_tables.append(table)
-                        batch_size += len(table)
-
-        if len(batch_tables) > 0:
-            yield pa.concat_tables(batch_tables)
+        fetched = self._fetched_files(batch_files["path"].tolist(), columns)
+        for (_, row), (path, sparse_file, fetch_time, wait_time) in zip(
+            batch_files.iterrows(), fetched
+        ):
+            parquet_file = pq.ParquetFile(sparse_file, **self.kwargs)
+            # ### Do not attempt to process empty files
+            if parquet_file.metadata.num_rows == 0:
+                continue
+            # ### end of patch
+            batches = parquet_file.iter_batches(
+                batch_size=self.chunksize, columns=columns
+            )
+            num_rows = 0
+            decode_time = 0.0
+            while True:
+                # Only time the decoding, not the consumer of the yielded tables
+                decode_start = time.perf_counter()
+                batch = next(batches, None)
+                decode_time += time.perf_counter() - decode_start
+                if batch is None:
+                    break
+                num_rows += len(batch)
+
+                if read_columns is None:
+                    ## splitting stage - add in dimension columns
+                    batch = self._add_dimensions(batch, row, added_columns)
+                else:
+                    batch = batch.replace_schema_metadata()
+                pending.append(batch)
+                pending_rows += len(batch)
+                while pending_rows >= self.chunksize:
+                    # We've hit our chunksize, send the batch off to the task.
+                    pending_rows -= self.chunksize
+                    yield pop_rows(pending, self.chunksize)
+
+            timing = {
+                "path": path,
+                "bytes_fetched": sparse_file.nbytes,
+                "rows": num_rows,
+                "fetch_seconds": fetch_time,
+                "wait_seconds": wait_time,
+                "decode_seconds": decode_time,
+            }
+            self.timings.append(timing)
+            logger.debug("Read %s", timing)
+
+        if pending_rows > 0:
+            yield pop_rows(pending, pending_rows)
@@ -0,0 +1,189 @@
+"""Per-field, per-band statistics of the columns of a catalog, in one pass.
+
+Every partition is reduced, with a single groupby, to partial aggregates of
+its rows in each field: the count, sum, sum of squares, min, max and null
+count of every column, by field and band. Partial aggregates merge with
+sums and min/max, so they are tree-reduced on the cluster, and only the
+final aggregates of all the fields come back to be finalized into means,
+standard deviations and ranges.
+"""
+
+import numpy as np
+import pandas as pd
+
+# How partial aggregates of the same field, band and column merge
+MERGE_STATS = {
+    "count": "sum",
+    "sum": "sum",
+    "sum_sq": "sum",
+    "min": "min",
+    "max": "max",
+    "null_count": "sum",
+}
+EXCLUDED_COLUMNS = ["_healpix_29", "Norder", "Dir", "Npix"]
+
+
+def stat_columns(meta):
+    """Columns to compute statistics of: the numeric ones, except the HATS
+    columns, identifiers and magnitudes (derived from fluxes)."""
+    return [
+        column
+        for column in meta.select_dtypes(include=np.number).columns
+        if column not in EXCLUDED_COLUMNS
+        and not column.endswith("Id")
+        and "Mag" not in column
+    ]
+
+
+def angular_separation_deg(ra, dec, center_ra, center_dec):
+    """Great-circle distance of points to a center, in degrees (haversine)."""
+    ra, dec = np.radians(ra), np.radians(dec)
+    center_ra, center_dec = np.radians(center_ra), np.radians(center_dec)
+    hav = (
+        np.sin((dec - center_dec) / 2) ** 2
+        + np.cos(dec) * np.cos(center_dec) * np.sin((ra - center_ra) / 2) ** 2
+    )
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(hav, 0, 1))))
+
+
+def empty_partial_stats():
+    index = pd.MultiIndex.from_arrays(
+        [pd.Index([], dtype=object)] * 3, names=["field", "band", "column"]
+    )
+    return pd.DataFrame(
+        {stat: pd.Series([], dtype=np.float64) for stat in MERGE_STATS}, index=index
+    )
+
+
+def partial_field_stats(
+    df, fields, radius_arcsec, columns, bands, ra_column, dec_column
+):
+    """Partial aggregates of the columns of a partition, for its rows within
+    the radius of each field (a row may be in several fields) and of each band.
+
+    Sky sources are excluded.
+    """
+    if "sky_source" in df.columns:
+        df = df[df["sky_source"].eq(False)]
+    ra = df[ra_column].to_numpy(dtype=np.float64)
+    dec = df[dec_column].to_numpy(dtype=np.float64)
+    in_band = np.isin(df["band"].to_numpy(dtype=object), bands)
+    rows, field_names = [], []
+    for name, (center_ra, center_dec) in fields.items():
+        in_field = angular_separation_deg(ra, dec, center_ra, center_dec)
+        selected = np.flatnonzero((in_field <= radius_arcsec / 3600) & in_band)
+        rows.append(selected)
+        field_names.append(np.full(len(selected), name, dtype=object))
+    rows = np.concatenate(rows)
+    if not len(rows):
+        return empty_partial_stats()
+
+    values = pd.DataFrame(
+        df[columns].to_numpy(dtype=np.float64, na_value=np.nan)[rows],
+        columns=columns,
+    )
+    keys = [
+        np.concatenate(field_names),
+        df["band"].to_numpy(dtype=object)[rows],
+    ]
+    grouped = values.groupby(keys)
+    count = grouped.count()
+    partial = pd.concat(
+        {
+            "count": count,
+            "sum": grouped.sum(),
+            "sum_sq": (values**2).groupby(keys).sum(),
+            "min": grouped.min(),
+            "max": grouped.max(),
+            "null_count": count.rsub(grouped.size(), axis=0),
+        },
+        axis=1,
+    )
+    partial = partial.stack(level=1, future_stack=True).astype(np.float64)
+    partial.index.names = ["field", "band", "column"]
+    return partial
+
+
+def merge_partial_stats(partials):
+    """Merge concatenated partial aggregates of the same field, band and column."""
+    if partials.empty:
+        return empty_partial_stats()
+    return partials.groupby(level=["field", "band", "column"], sort=False).agg(
+        MERGE_STATS
+    )
+
+
+def finalize_field_stats(merged, fields, columns, bands):
+    """Means, standard deviations, ranges and null counts of every column and
+    band, with the number of rows of every band, as a frame with a row per
+    statistic (e.g. mean_psfFlux_r) and a column per field.
+
+    The number of rows of a band only counts those with an x position when
+    the catalog has one.
+    """
+    results = {}
+    for field in fields:
+        if field not in merged.index.get_level_values("field"):
+            results[field] = {}
+            continue
+        field_stats = merged.xs(field, level="field")
+        count = field_stats["count"]
+        mean = field_stats["sum"] / count
+        variance = (field_stats["sum_sq"] / count - mean**2).clip(lower=0)
+        stats = {}
+        for column in columns:
+            for band in bands:
+                if (band, column) not in field_stats.index:
+                    continue
+                key = (band, column)
+                stats[f"mean_{column}_{band}"] = mean[key]
+                stats[f"std_{column}_{band}"] = np.sqrt(variance[key])
+                stats[f"min_{column}_{band}"] = field_stats["min"][key]
+                stats[f"max_{column}_{band}"] = field_stats["max"][key]
+                stats[f"nulls_{column}_{band}"] = field_stats["null_count"][key]
+        length_column = "x" if "x" in columns else columns[0]
+        for band in bands:
+            key = (band, length_column)
+            if key in field_stats.index:
+                stats[f"len_{band}"] = (
+                    count[key]
+                    if length_column == "x"
+                    else count[key] + field_stats["null_count"][key]
+                )
+        results[field] = stats
+    return pd.DataFrame.from_dict(results, orient="index").T
+
+
+def field_band_stats(catalog, fields, radius_arcsec, bands, split_every=16):
+    """Per-field, per-band statistics of the numeric columns of a catalog.
+
+    Only the partitions overlapping a field are read, and all the fields are
+    evaluated in the same pass over them.
+    """
+    columns = stat_columns(catalog._ddf._meta)
+    print("effective column count", len(columns))
+    pixels = {
+        pixel
+        for center_ra, center_dec in fields.values()
+        for pixel in catalog.cone_search(
+            ra=center_ra, dec=center_dec, radius_arcsec=radius_arcsec
+        ).get_healpix_pixels()
+    }
+    catalog = catalog.pixel_search(sorted(pixels))
+    catalog_info = catalog.hc_structure.catalog_info
+    merged = catalog._ddf.reduction(
+        partial_field_stats,
+        combine=merge_partial_stats,
+        aggregate=merge_partial_stats,
+        meta=empty_partial_stats(),
+        split_every=split_every,
+        chunk_kwargs={
+            "fields": fields,
+            "radius_arcsec": radius_arcsec,
+            "columns": columns,
+            "bands": bands,
+            "ra_column": catalog_info.ra_column,
+            "dec_column": catalog_info.dec_column,
+        },
+    ).compute()
+    return finalize_field_stats(merged, fields, columns, bands)
@@ -0,0 +1,97 @@
+"""Scan the parquet footers of many files in parallel, reading only their tail bytes.
+
+A parquet file ends with its Thrift-encoded metadata, followed by the 4-byte
+metadata length and the ``PAR1`` magic. We fetch the last FOOTER_READAHEAD
+bytes in a single ranged read, which covers the metadata of almost every
+file, and only issue a second read when a footer is larger than that.
+"""
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from lsst.resources import ResourcePath
+from tqdm import tqdm
+
+# Same as the speculative footer read of the parquet C++ reader
+FOOTER_READAHEAD = 64 * 1024
+PARQUET_MAGIC = b"PAR1"
+
+
+def read_footer_bytes(f, file_size):
+    """Read the tail of an open, seekable parquet file, at least FOOTER_READAHEAD
+    bytes and always the whole footer (metadata, length and magic)."""
+    readahead = min(FOOTER_READAHEAD, file_size)
+    f.seek(file_size - readahead)
+    tail = f.read(readahead)
+    if tail[-4:] != PARQUET_MAGIC:
+        raise ValueError("not a parquet file")
+    footer_length = int.from_bytes(tail[-8:-4], "little") + 8
+    if footer_length > len(tail):
+        f.seek(file_size - footer_length)
+        tail = f.read(footer_length)
+    return tail
+
+
+def read_footer(path):
+    """Read the footer of a parquet file, returning its metadata and the file size."""
+    resource = ResourcePath(path)
+    file_size = resource.size()
+    with resource.open("rb") as f:
+        try:
+            footer = read_footer_bytes(f, file_size)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from e
+    metadata = pq.read_metadata(pa.BufferReader(footer))
+    return metadata, file_size
+
+
+def footer_stats(path):
+    """Per-file totals and per-column byte sizes from a single footer read."""
+    metadata, file_size = read_footer(path)
+    compressed = defaultdict(int)
+    uncompressed = defaultdict(int)
+    for rg_index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg_index)
+        for col_index in range(row_group.num_columns):
+            column = row_group.column(col_index)
+            compressed[column.path_in_schema] += column.total_compressed_size
+            uncompressed[column.path_in_schema] += column.total_uncompressed_size
+    file_stats = {
+        "file_size": file_size,
+        "num_rows": metadata.num_rows,
+        "num_row_groups": metadata.num_row_groups,
+        "num_columns": metadata.num_columns,
+        "compressed_size": sum(compressed.values()),
+        "uncompressed_size": sum(uncompressed.values()),
+    }
+    return file_stats, compressed, uncompressed
+
+
+def scan_footers(paths, max_workers=32):
+    """Read the footers of all paths with a pool of threads.
+
+    Returns a frame with one row of totals per file (in the order of paths),
+    and a frame of compressed/uncompressed sizes per column, summed over all
+    files.
+    """
+    file_rows = []
+    compressed = defaultdict(int)
+    uncompressed = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(footer_stats, paths)
+        for file_stats, file_compressed, file_uncompressed in tqdm(
+            results, total=len(paths)
+        ):
+            file_rows.append(file_stats)
+            for column, size in file_compressed.items():
+                compressed[column] += size
+            for column, size in file_uncompressed.items():
+                uncompressed[column] += size
+    file_sizes = pd.DataFrame(file_rows)
+    column_sizes = pd.DataFrame(
+        {"compressed_size": compressed, "uncompressed_size": uncompressed}
+    ).rename_axis("column")
+    return file_sizes, column_sizes
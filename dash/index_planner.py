@@ -0,0 +1,93 @@
+"""Plan size-balanced index files for the hats-import input file list.
+
+Each index file becomes one task of the import pipeline. Grouping files by
+tract makes task sizes follow tract sizes, which are very skewed, so a few
+huge tracts end up as stragglers. Instead, we bin-pack files into index files
+of near-equal work with the longest-processing-time-first heuristic.
+
+Every row of an index file keeps the dimension values of its own file, so
+files of different tracts (or bands, days) can safely share an index file.
+"""
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+
+def file_costs(sizes):
+    """Estimated work per file, in bytes.
+
+    Reading scales with the bytes on disk, while splitting and sorting scale
+    with the rows, so both count equally: rows are converted to bytes with the
+    average bytes per row over all files.
+    """
+    file_size = sizes["file_size"].to_numpy(dtype=np.float64)
+    num_rows = sizes["num_rows"].to_numpy(dtype=np.float64)
+    bytes_per_row = file_size.sum() / max(num_rows.sum(), 1)
+    return 0.5 * (file_size + num_rows * bytes_per_row)
+
+
+def pack_files(costs, num_bins):
+    """Assign each file to one of num_bins bins, largest files first, always
+    into the currently lightest bin. Returns the bin index of every file."""
+    num_bins = max(1, min(num_bins, len(costs)))
+    bins = [(0.0, index) for index in range(num_bins)]
+    assignment = np.empty(len(costs), dtype=np.int64)
+    for file_index in np.argsort(costs)[::-1]:
+        load, bin_index = heapq.heappop(bins)
+        assignment[file_index] = bin_index
+        heapq.heappush(bins, (load + costs[file_index], bin_index))
+    return assignment
+
+
+def predicted_makespan(task_costs, n_workers):
+    """Simulate workers pulling tasks in the given order; returns the finish
+    time of the last one, in the units of task_costs."""
+    workers = [0.0] * n_workers
+    for cost in task_costs:
+        heapq.heappush(workers, heapq.heappop(workers) + cost)
+    return max(workers)
+
+
+def makespan_report(task_costs, n_workers):
+    """Summary of the predicted run of a list of tasks on n_workers."""
+    task_costs = np.asarray(task_costs, dtype=np.float64)
+    ideal = task_costs.sum() / n_workers
+    makespan = predicted_makespan(task_costs, n_workers)
+    return {
+        "tasks": len(task_costs),
+        "largest_task_gib": task_costs.max() / 1024**3,
+        "smallest_task_gib": task_costs.min() / 1024**3,
+        "predicted_makespan_gib": makespan / 1024**3,
+        "ideal_makespan_gib": ideal / 1024**3,
+        "efficiency": ideal / makespan,
+    }
+
+
+def plan_index_files(sizes, num_bins):
+    """Pack the files of a sizes frame into num_bins balanced index files.
+
+    Returns the sizes frame with an ``index_file`` column, where index file 0
+    holds the most work, so that writing the files in order submits the
+    largest tasks first.
+    """
+    costs = file_costs(sizes)
+    assignment = pack_files(costs, num_bins)
+    bin_costs = np.bincount(assignment, weights=costs)
+    rank = np.empty_like(bin_costs, dtype=np.int64)
+    rank[np.argsort(bin_costs)[::-1]] = np.arange(len(bin_costs))
+    return sizes.assign(index_file=rank[assignment], cost=costs)
+
+
+def compare_plans(sizes, planned, groupby, n_workers):
+    """Predicted makespan of grouping files by dimension vs. the balanced plan."""
+    costs = pd.Series(file_costs(sizes), index=sizes.index)
+    grouped = costs.groupby([sizes[column] for column in groupby]).sum()
+    balanced = planned.groupby("index_file")["cost"].sum().sort_index()
+    return pd.DataFrame(
+        {
+            f"by {'/'.join(groupby)}": makespan_report(grouped.to_numpy(), n_workers),
+            "balanced": makespan_report(balanced.to_numpy(), n_workers),
+        }
+    )
@@ -0,0 +1,36 @@
+"""Margin caches and collections of several HATS catalogs, built together on
+one client.
+
+hats-import builds one margin cache (or collection) at a time, and the
+cluster idles while the last tasks of each stage finish. Here the stock
+hats-import pipeline of every catalog runs in its own thread, on the same
+client, so that the tasks of all of them are interleaved on the workers.
+Each run has its own outputs and resume state, as if it was run alone.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hats_import import pipeline_with_client
+
+
+def run_pipelines(pipeline_args, client):
+    """Run hats-import pipelines (any RuntimeArguments) concurrently on a
+    client. Raises the first failure once all of them have finished."""
+    with ThreadPoolExecutor(max_workers=max(len(pipeline_args), 1)) as executor:
+        futures = [
+            executor.submit(pipeline_with_client, args, client)
+            for args in pipeline_args
+        ]
+    for future in futures:
+        future.result()
+
+
+def generate_margin_caches(margin_args, client):
+    """Generate the margin caches of a list of MarginCacheArguments at once."""
+    run_pipelines(margin_args, client)
+
+
+def run_collections(collection_args, client):
+    """Run the collection pipeline of hats-import for several collections at
+    once, so that their margin caches and indexes are built concurrently."""
+    run_pipelines(collection_args, client)
@@ -0,0 +1,350 @@
+"""Crossmatch a catalog with several catalogs at once, into association tables.
+
+Crossmatching a collection with each remote catalog in turn (lsdb's
+crossmatch, then to_association) loads every partition of the collection,
+and builds a k-D tree of its points, once per remote catalog. Here a single
+task per partition of the left catalog loads it, with only its identifier
+and positions, builds the tree of its points once, and matches it with the
+aligned partitions (and margins) of all the right catalogs. The matches
+with each right catalog are written straight away as a partition of its
+association table, so every association is written in the same pass.
+Associations are written in a temporary directory, renamed when complete,
+so that a failed run leaves nothing behind.
+
+The matches are those of lsdb's k-D tree crossmatch: the n_neighbors
+nearest points of the right catalog within the radius of every left point.
+benchmarks/crossmatch_benchmark.py checks that the associations are the
+same as those of lsdb, on synthetic catalogs.
+"""
+
+import dataclasses
+import warnings
+
+import dask
+import hats
+import hats.io as file_io
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from hats.catalog import CatalogType, PartitionInfo, TableProperties
+from hats.catalog.catalog_collection import CatalogCollection
+from hats.pixel_math import HealpixPixel
+from hats.pixel_math.spatial_index import healpix_to_spatial_index
+from lsdb.dask.merge_catalog_functions import (
+    align_catalogs,
+    get_healpix_pixels_from_alignment,
+)
+from scipy.spatial import KDTree
+
+SEPARATION_COLUMN = "_dist_arcsec"
+
+
+@dataclasses.dataclass
+class CrossmatchTarget:
+    """A right catalog to crossmatch with, and its association table."""
+
+    # Short name, e.g. "ztf_dr22": the association is "<left>_x_<name>"
+    name: str
+    catalog: object
+    # Identifier in the right catalog, and its suffix in the association
+    id_column: str
+    suffix: str
+
+    @property
+    def association_column(self):
+        return f"{self.id_column}{self.suffix}"
+
+
+def unit_vectors(ra, dec):
+    """Cartesian coordinates on the unit sphere of positions in degrees."""
+    ra, dec = np.radians(ra), np.radians(dec)
+    return np.stack(
+        [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=1
+    )
+
+
+def chord_to_arcsec(chord):
+    return np.degrees(2 * np.arcsin(0.5 * chord)) * 3600
+
+
+def in_pixel(index, pixel):
+    """Mask of the rows of a partition (indexed by spatial index) in a pixel."""
+    lower = healpix_to_spatial_index(pixel.order, pixel.pixel)
+    upper = healpix_to_spatial_index(pixel.order, pixel.pixel + 1)
+    return (index >= lower) & (index < upper)
+
+
+def nearest_pairs(left_rows, chords, n_neighbors):
+    """Positions of the pairs of the n_neighbors nearest right points of every
+    left point, ordered by left point and distance."""
+    order = np.lexsort((chords, left_rows))
+    left_rows = left_rows[order]
+    starts = np.flatnonzero(np.r_[True, left_rows[1:] != left_rows[:-1]])
+    sizes = np.diff(np.r_[starts, len(left_rows)])
+    rank = np.arange(len(left_rows)) - np.repeat(starts, sizes)
+    return order[rank < n_neighbors]
+
+
+def match_partition(
+    left_df,
+    left_pixel,
+    right_partitions,
+    left_columns,
+    right_columns,
+    base_paths,
+    radius_arcsec,
+    n_neighbors,
+):
+    """Match a left partition with the aligned partitions of every right
+    catalog, and write the matches with each as a partition of its
+    association table.
+
+    right_partitions holds, for every right catalog, the (pixel, partition,
+    margin) of its partitions aligned with the left one. left_columns are the
+    identifier, ra and dec columns of the left catalog, and right_columns the
+    identifier, ra, dec and association columns of every right catalog.
+
+    Returns the number of matches and their largest separation, per right
+    catalog.
+    """
+    if len(left_df) == 0:
+        return [(0, -1)] * len(right_partitions)
+    id_column, ra_column, dec_column = left_columns
+    left_xyz = unit_vectors(
+        left_df[ra_column].to_numpy(dtype=np.float64),
+        left_df[dec_column].to_numpy(dtype=np.float64),
+    )
+    # Built once, for all the right catalogs
+    tree = KDTree(left_xyz, compact_nodes=True, balanced_tree=True, copy_data=False)
+    max_chord = 2 * np.sin(np.radians(radius_arcsec / 3600) / 2)
+    left_index = left_df.index.to_numpy()
+
+    results = []
+    for partitions, columns, base_path in zip(
+        right_partitions, right_columns, base_paths
+    ):
+        right_id_column, right_ra_column, right_dec_column, association_column = columns
+        left_rows, right_ids, chords = [], [], []
+        for right_pixel, right_df, margin_df in partitions:
+            right_df = pd.concat([df for df in [right_df, margin_df] if df is not None])
+            if len(right_df) == 0:
+                continue
+            right_tree = KDTree(
+                unit_vectors(
+                    right_df[right_ra_column].to_numpy(dtype=np.float64),
+                    right_df[right_dec_column].to_numpy(dtype=np.float64),
+                ),
+                compact_nodes=True,
+                balanced_tree=True,
+                copy_data=False,
+            )
+            pairs = tree.sparse_distance_matrix(
+                right_tree, max_chord, output_type="ndarray"
+            )
+            i, j, chord = pairs["i"], pairs["j"], pairs["v"]
+            if right_pixel.order > left_pixel.order:
+                # Only the left points in the right pixel: the others are
+                # matched with the partition of their own right pixel
+                inside = in_pixel(left_index[i], right_pixel)
+                i, j, chord = i[inside], j[inside], chord[inside]
+            left_rows.append(i)
+            right_ids.append(right_df[right_id_column].iloc[j])
+            chords.append(chord)
+        if not sum(map(len, left_rows)):
+            results.append((0, -1))
+            continue
+
+        left_rows, chords = np.concatenate(left_rows), np.concatenate(chords)
+        nearest = nearest_pairs(left_rows, chords, n_neighbors)
+        matches = left_df[[id_column]].iloc[left_rows[nearest]]
+        matches[association_column] = pd.Series(
+            pd.concat(right_ids).iloc[nearest].array, index=matches.index
+        )
+        matches[SEPARATION_COLUMN] = pd.Series(
+            chord_to_arcsec(chords[nearest]),
+            index=matches.index,
+            dtype=pd.ArrowDtype(pa.float64()),
+        )
+
+        pixel_dir = file_io.pixel_directory(
+            base_path, left_pixel.order, left_pixel.pixel
+        )
+        file_io.file_io.make_directory(pixel_dir, exist_ok=True)
+        pixel_path = file_io.paths.pixel_catalog_file(base_path, left_pixel)
+        matches.to_parquet(pixel_path.path, filesystem=pixel_path.fs)
+        results.append((len(matches), matches[SEPARATION_COLUMN].max()))
+    return results
+
+
+def aligned_right_partitions(left, right):
+    """The (pixel, partition, margin) of the partitions of a right catalog
+    aligned with each pixel of a left catalog."""
+    alignment = align_catalogs(left, right, add_right_margin=True)
+    partitions = right.to_delayed()
+    margins = right.margin.to_delayed() if right.margin is not None else None
+    aligned = {}
+    for left_pixel, right_pixel in zip(*get_healpix_pixels_from_alignment(alignment)):
+        if right_pixel not in right.hc_structure.pixel_tree:
+            # Only in the margin: no partition of its own
+            continue
+        margin = None
+        if margins is not None and right_pixel in right.margin.hc_structure.pixel_tree:
+            margin = margins[
+                right.margin.get_partition_index(right_pixel.order, right_pixel.pixel)
+            ]
+        aligned.setdefault(left_pixel, []).append(
+            (
+                right_pixel,
+                partitions[
+                    right.get_partition_index(right_pixel.order, right_pixel.pixel)
+                ],
+                margin,
+            )
+        )
+    return aligned
+
+
+def catalog_columns(catalog_dir):
+    """Columns of a catalog, or of the main catalog of a collection (None if
+    its schema is unknown)."""
+    catalog = hats.read_hats(catalog_dir)
+    if isinstance(catalog, CatalogCollection):
+        catalog = catalog.main_catalog
+    schema = catalog.original_schema or catalog.schema
+    return None if schema is None else schema.names
+
+
+def association_properties(left_catalog_dir, left_id_column, target):
+    """The properties of an association that name its catalogs and columns,
+    after checking that the identifier columns exist."""
+    join_catalog_dir = target.catalog.hc_structure.catalog_path
+    for catalog_dir, column in [
+        (left_catalog_dir, left_id_column),
+        (join_catalog_dir, target.id_column),
+    ]:
+        columns = catalog_columns(catalog_dir)
+        if columns is not None and column not in columns:
+            raise ValueError(f"{column} is not a column of {catalog_dir}")
+    return {
+        "primary_catalog": str(left_catalog_dir),
+        "primary_column": left_id_column,
+        "primary_column_association": left_id_column,
+        "join_catalog": str(join_catalog_dir),
+        "join_column": target.id_column,
+        "join_column_association": target.association_column,
+    }
+
+
+def crossmatch_associations(
+    left,
+    targets,
+    *,
+    left_id_column,
+    left_catalog_dir,
+    radius_arcsec,
+    n_neighbors=1,
+    overwrite=False,
+):
+    """Crossmatch a catalog with several catalogs in a single pass over it,
+    writing an association table with each in <left_catalog_dir>, named
+    "<left>_x_<target>".
+
+    Every association is first written in a hidden temporary directory next
+    to it, and renamed when complete.
+    """
+    for target in targets:
+        right = target.catalog
+        if right.margin is None:
+            warnings.warn(
+                f"{target.name} does not have a margin cache. "
+                "Results may be incomplete and/or inaccurate.",
+                RuntimeWarning,
+            )
+        elif right.margin.hc_structure.catalog_info.margin_threshold < radius_arcsec:
+            raise ValueError(
+                f"Cross match radius is greater than the margin threshold of {target.name}"
+            )
+
+    left_name = left.hc_structure.catalog_name
+    left_info = left.hc_structure.catalog_info
+    final_paths, base_paths, column_args = [], [], []
+    for target in targets:
+        column_args.append(
+            association_properties(left_catalog_dir, left_id_column, target)
+        )
+        final_path = file_io.file_io.get_upath(
+            left_catalog_dir / f"{left_name}_x_{target.name}"
+        )
+        if file_io.file_io.directory_has_contents(final_path) and not overwrite:
+            raise ValueError(
+                f"base_catalog_path ({str(final_path)}) contains files."
+                " choose a different directory or set overwrite to True."
+            )
+        # Left over by a failed run, if any
+        base_path = final_path.parent / f".{final_path.name}.tmp"
+        file_io.file_io.remove_directory(base_path, ignore_errors=True)
+        file_io.file_io.make_directory(base_path, exist_ok=True)
+        final_paths.append(final_path)
+        base_paths.append(base_path)
+
+    left_columns = [left_id_column, left_info.ra_column, left_info.dec_column]
+    right_columns = [
+        (
+            target.id_column,
+            target.catalog.hc_structure.catalog_info.ra_column,
+            target.catalog.hc_structure.catalog_info.dec_column,
+            target.association_column,
+        )
+        for target in targets
+    ]
+    # Only the columns needed to match are read from the left catalog
+    left = left[left_columns]
+    aligned = [aligned_right_partitions(left, target.catalog) for target in targets]
+    left_partitions = left.to_delayed()
+    pixels, tasks = [], []
+    for pixel in left.get_healpix_pixels():
+        right_partitions = [target_aligned.get(pixel, []) for target_aligned in aligned]
+        if not any(right_partitions):
+            continue
+        pixels.append(pixel)
+        tasks.append(
+            dask.delayed(match_partition)(
+                left_partitions[left.get_partition_index(pixel.order, pixel.pixel)],
+                pixel,
+                right_partitions,
+                left_columns,
+                right_columns,
+                base_paths,
+                radius_arcsec,
+                n_neighbors,
+            )
+        )
+    results = dask.compute(*tasks)
+
+    for t, (target, base_path, final_path) in enumerate(
+        zip(targets, base_paths, final_paths)
+    ):
+        counts = np.array([result[t][0] for result in results], dtype=np.int64)
+        max_separations = np.array([result[t][1] for result in results])
+        non_empty = np.flatnonzero(counts)
+        if not len(non_empty):
+            raise RuntimeError(f"The association with {target.name} is empty")
+        partition_info = PartitionInfo(
+            [HealpixPixel(pixels[i].order, pixels[i].pixel) for i in non_empty]
+        )
+        file_io.write_parquet_metadata(base_path, create_thumbnail=False)
+        partition_info.write_to_file(base_path / "partition_info.csv")
+        TableProperties(
+            catalog_name=final_path.name,
+            catalog_type=CatalogType.ASSOCIATION,
+            contains_leaf_files=True,
+            hats_order=partition_info.get_highest_order(),
+            total_rows=int(counts.sum()),
+            moc_sky_fraction=f"{partition_info.calculate_fractional_coverage():0.5f}",
+            assn_max_separation=f"{max_separations[non_empty].max():0.5f}",
+            **column_args[t],
+        ).to_properties_file(base_path)
+        if file_io.file_io.does_file_or_directory_exist(final_path):
+            file_io.file_io.remove_directory(final_path)
+        base_path.rename(final_path)
+        print(f"Saved {final_path.name}: {counts.sum()} matches")
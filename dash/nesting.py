@@ -0,0 +1,350 @@
+"""Kernels on the nested columns of lsdb / nested-pandas catalogs.
+
+A nested column is stored as a list<struct> Arrow array: one flat struct
+array with a row per source, and list offsets delimiting the sources of
+each object. Sorting the sources of every object therefore only needs a
+permutation of the flat struct array within each list; the offsets stay
+the same.
+"""
+
+import dataclasses
+from pathlib import Path
+
+import hats
+import nested_pandas as npd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from hats.io import paths
+from hats.pixel_math import HealpixPixel
+from hats.pixel_math.spatial_index import (
+    SPATIAL_INDEX_COLUMN,
+    healpix_to_spatial_index,
+)
+from hats_import.catalog import ImportArguments
+from hats_import.catalog.file_readers import InputReader
+from nested_pandas.series.ext_array import NestedExtensionArray
+from nested_pandas.series.packer import pack_flat
+
+
+def list_segment_ids(offsets):
+    """Index of the list of every child row, from list offsets starting at 0."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def sort_list_array(list_array, by):
+    """Sort the children of every list of a list<struct> array by the given
+    struct fields (the first one being the primary key), in ascending order
+    with nulls and NaNs last. The sort is stable, and all the fields of the
+    struct are permuted with a single take."""
+    offsets = list_array.offsets.to_numpy()
+    start = offsets[0]
+    values = list_array.values.slice(start, offsets[-1] - start)
+    offsets = offsets - start
+    segment_ids = list_segment_ids(offsets)
+    # Lists of a single child are sorted already; only sort the others
+    order = np.arange(len(values))
+    movable = np.flatnonzero(np.diff(offsets)[segment_ids] > 1)
+    keys = [values.field(name).to_numpy(zero_copy_only=False)[movable] for name in by]
+    # lexsort sorts by its last key first: the list, then the fields in order
+    order[movable] = movable[np.lexsort(keys[::-1] + [segment_ids[movable]])]
+    return type(list_array).from_arrays(
+        pa.array(offsets, type=list_array.offsets.type),
+        values.take(order),
+        type=list_array.type,
+        mask=list_array.is_null() if list_array.null_count else None,
+    )
+
+
+def sort_nested_column(series, by):
+    """Sort the rows of every nested frame of a nested series by some fields."""
+    by = [by] if isinstance(by, str) else list(by)
+    list_array = series.array.list_array
+    sorted_array = pa.chunked_array(
+        [sort_list_array(chunk, by) for chunk in list_array.chunks],
+        type=list_array.type,
+    )
+    return pd.Series(
+        NestedExtensionArray(sorted_array), index=series.index, name=series.name
+    )
+
+
+def sort_nested_sources(df, source_cols, by="midpointMjdTai"):
+    """For each object, sort the sources of every nested column by timestamp
+    (or any other field(s) given in ``by``)."""
+    return df.assign(
+        **{
+            source_col: sort_nested_column(df[source_col], by)
+            for source_col in source_cols
+        }
+    )
+
+
+@dataclasses.dataclass
+class NestedSource:
+    """A source catalog to nest into objects, with the columns to keep."""
+
+    catalog_dir: str | Path
+    margin_dir: str | Path | None
+    left_on: str
+    right_on: str
+    columns: list[str] | None = None
+
+
+def plan_nested_columns(desired_cols, object_dir, sources, sort_by="midpointMjdTai"):
+    """Split the desired columns of a nested catalog (e.g. ``ra`` or
+    ``diaSource.psfMag``) into the columns to read from the object catalog
+    and from each source catalog.
+
+    Join keys, positions and the sort key are always read. Sets the columns
+    of every NestedSource in place, and returns the object columns and the
+    desired columns that none of the catalogs has.
+    """
+    object_info = hats.read_hats(object_dir)
+    available = set(object_info.schema.names)
+    object_cols = [col for col in desired_cols if "." not in col and col in available]
+    required = [object_info.catalog_info.ra_column, object_info.catalog_info.dec_column]
+    required += [source.left_on for source in sources.values()]
+    missing = [col for col in desired_cols if "." not in col and col not in available]
+    for name, source in sources.items():
+        source_info = hats.read_hats(source.catalog_dir)
+        fields = set(source_info.schema.names)
+        desired = [
+            col.split(".", 1)[1] for col in desired_cols if col.startswith(f"{name}.")
+        ]
+        missing += [f"{name}.{field}" for field in desired if field not in fields]
+        source.columns = list(
+            dict.fromkeys(
+                [field for field in desired if field in fields]
+                + [
+                    source.right_on,
+                    source_info.catalog_info.ra_column,
+                    source_info.catalog_info.dec_column,
+                ]
+                + ([sort_by] if sort_by in fields else [])
+            )
+        )
+    return list(dict.fromkeys(object_cols + required)), missing
+
+
+@dataclasses.dataclass
+class LeafFiles:
+    """The leaf files of a catalog, with the spatial index range of their
+    pixels, to find those overlapping a pixel without reading the catalog."""
+
+    catalog_dir: str
+    npix_suffix: str
+    orders: np.ndarray
+    pixels: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    @classmethod
+    def of_catalog(cls, catalog_dir):
+        catalog = hats.read_hats(catalog_dir)
+        pixels = catalog.get_healpix_pixels()
+        orders = np.array([pixel.order for pixel in pixels], dtype=np.int64)
+        numbers = np.array([pixel.pixel for pixel in pixels], dtype=np.int64)
+        lower = healpix_to_spatial_index(orders, numbers)
+        order = np.argsort(lower)
+        return cls(
+            str(catalog_dir),
+            catalog.catalog_info.npix_suffix,
+            orders[order],
+            numbers[order],
+            lower[order],
+            healpix_to_spatial_index(orders, numbers + 1)[order],
+        )
+
+    def path(self, i):
+        return paths.pixel_catalog_file(
+            self.catalog_dir,
+            HealpixPixel(int(self.orders[i]), int(self.pixels[i])),
+            npix_suffix=self.npix_suffix,
+        )
+
+    def overlapping(self, pixel):
+        """Positions of the leaves overlapping a pixel (coarser or finer)."""
+        lower = healpix_to_spatial_index(pixel.order, pixel.pixel)
+        upper = healpix_to_spatial_index(pixel.order, pixel.pixel + 1)
+        start = np.searchsorted(self.upper, lower, side="right")
+        end = np.searchsorted(self.lower, upper, side="left")
+        return range(start, end)
+
+    def find(self, order, pixel):
+        """Position of the leaf of a pixel, or None."""
+        i = np.searchsorted(self.lower, healpix_to_spatial_index(order, pixel))
+        if i < len(self.lower) and self.orders[i] == order and self.pixels[i] == pixel:
+            return i
+        return None
+
+
+def read_leaf(path, columns):
+    """Some columns of a leaf file, indexed by spatial index, as lsdb reads it."""
+    table = pq.read_table(
+        path.path,
+        filesystem=path.fs,
+        columns=list(dict.fromkeys([SPATIAL_INDEX_COLUMN] + list(columns))),
+    )
+    frame = table.select(
+        [column for column in table.column_names if column != SPATIAL_INDEX_COLUMN]
+    ).to_pandas(types_mapper=pd.ArrowDtype, ignore_metadata=True)
+    frame.index = pd.Index(
+        table[SPATIAL_INDEX_COLUMN].to_numpy(), name=SPATIAL_INDEX_COLUMN
+    )
+    return npd.NestedFrame(frame)
+
+
+class NestedCatalogReader(InputReader):
+    """Read the partitions of an object catalog with its sources nested in.
+
+    Used as the file reader of a hats-import run whose input files are the
+    leaf files of the object catalog, to write a nested catalog with its own
+    partitioning in a single pass. The splitting stage joins each object
+    partition with the (column-projected) sources of its pixel and their
+    margins, and sorts the nested sources. The mapping stage only reads the
+    spatial index and join keys of the objects, and the identifiers of the
+    sources, to count the objects that the join keeps.
+
+    The source catalogs and margins are opened once, here: every partition
+    is then read from its leaf files only. The join is lsdb's join_nested
+    (inner): the objects of every part of the pixel covered by a source
+    partition get the sources of that partition and of its margin, and
+    objects without sources are dropped.
+    """
+
+    def __init__(self, object_columns, sources, sort_by="midpointMjdTai"):
+        self.object_columns = object_columns
+        self.sources = sources
+        self.sort_by = sort_by
+        self.leaves = {
+            name: LeafFiles.of_catalog(source.catalog_dir)
+            for name, source in sources.items()
+        }
+        self.margin_leaves = {
+            name: LeafFiles.of_catalog(source.margin_dir)
+            for name, source in sources.items()
+            if source.margin_dir is not None
+        }
+
+    def _overlapping_sources(self, frame, pixel, name, columns):
+        """For every source partition overlapping a pixel, the objects of the
+        pixel in its range, and its sources and those of its margin."""
+        leaves = self.leaves[name]
+        margin_leaves = self.margin_leaves.get(name)
+        index = frame.index.to_numpy()
+        for i in leaves.overlapping(pixel):
+            objects = frame[(index >= leaves.lower[i]) & (index < leaves.upper[i])]
+            if not len(objects):
+                continue
+            sources = [read_leaf(leaves.path(i), columns)]
+            margin = None
+            if margin_leaves is not None:
+                margin = margin_leaves.find(leaves.orders[i], leaves.pixels[i])
+            if margin is not None:
+                sources.append(read_leaf(margin_leaves.path(margin), columns))
+            yield objects, pd.concat(sources)
+
+    def join_source(self, frame, pixel, name):
+        """Nest the sources of a source catalog into the objects of a pixel."""
+        source = self.sources[name]
+        joined = []
+        for objects, sources in self._overlapping_sources(
+            frame, pixel, name, source.columns
+        ):
+            nested = pack_flat(
+                npd.NestedFrame(sources.set_index(source.right_on))
+            ).rename(name)
+            joined.append(
+                objects.reset_index()
+                .merge(nested, left_on=source.left_on, right_index=True, how="inner")
+                .set_index(SPATIAL_INDEX_COLUMN)
+            )
+        if not joined:
+            return None
+        return npd.NestedFrame(pd.concat(joined))
+
+    def match_source(self, frame, pixel, name):
+        """The objects of a pixel that join_source keeps, reading only the
+        identifiers of the sources."""
+        source = self.sources[name]
+        matched = [
+            objects[objects[source.left_on].isin(sources[source.right_on])]
+            for objects, sources in self._overlapping_sources(
+                frame, pixel, name, [source.right_on]
+            )
+        ]
+        if not matched:
+            return None
+        return pd.concat(matched)
+
+    def read(self, input_file, read_columns=None):
+        input_file = self.regular_file_exists(input_file)
+        pixel = paths.get_healpix_from_path(str(input_file))
+        if read_columns is not None:
+            # Count only the objects with sources, as the splitting stage does
+            keys = list(
+                dict.fromkeys(source.left_on for source in self.sources.values())
+            )
+            frame = read_leaf(input_file, keys + list(read_columns))
+            for name in self.sources:
+                frame = self.match_source(frame, pixel, name)
+                if frame is None:
+                    return
+            yield frame
+            return
+        frame = read_leaf(input_file, self.object_columns)
+        for name in self.sources:
+            frame = self.join_source(frame, pixel, name)
+            if frame is None:
+                return
+        yield sort_nested_sources(frame, list(self.sources), by=self.sort_by)
+
+
+def nested_import_arguments(
+    object_dir, output_dir, output_artifact_name, desired_cols, sources, **kwargs
+):
+    """Import arguments writing the nested catalog of an object catalog and
+    its sources, with only the desired columns, in a single pass.
+
+    Like ImportArguments.reimport_from_hats, the properties of the object
+    catalog are carried over, and any import argument can be overridden.
+    The desired columns found in the catalogs become the default columns.
+    """
+    object_dir = Path(object_dir)
+    catalog_info = hats.read_hats(object_dir).catalog_info
+    object_columns, missing_cols = plan_nested_columns(
+        desired_cols, object_dir, sources
+    )
+    if missing_cols:
+        print(
+            "Warning: requested default columns missing from catalog: "
+            + ", ".join(sorted(missing_cols))
+        )
+    addl_hats_properties = catalog_info.extra_dict(by_alias=True)
+    addl_hats_properties.update(
+        {
+            "hats_cols_default": ",".join(
+                [col for col in desired_cols if col not in missing_cols]
+            ),
+            "hats_npix_suffix": catalog_info.npix_suffix,
+        }
+    )
+    addl_hats_properties.update(kwargs.pop("addl_hats_properties", {}))
+    import_args = {
+        "catalog_type": catalog_info.catalog_type,
+        "ra_column": catalog_info.ra_column,
+        "dec_column": catalog_info.dec_column,
+        "input_file_list": sorted(
+            (object_dir / "dataset").rglob(f"Norder*/**/*{catalog_info.npix_suffix}")
+        ),
+        "file_reader": NestedCatalogReader(object_columns, sources),
+        "output_artifact_name": output_artifact_name,
+        "output_path": output_dir,
+        "use_healpix_29": True,
+        "add_healpix_29": False,
+        "addl_hats_properties": addl_hats_properties,
+    }
+    import_args.update(kwargs)
+    return ImportArguments(**import_args)
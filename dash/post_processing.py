@@ -0,0 +1,245 @@
+"""Arrow-native post-processing of the leaf files of a HATS catalog.
+
+Magnitudes and their errors are computed straight from the flux columns with
+pyarrow.compute, MJDs are looked up in the visit index and double-precision
+columns are cast to single precision. Leaf files are rewritten one row group
+at a time, so a partition is never fully held in memory.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import hats
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from hats.catalog import PartitionInfo
+from hats.io import file_io, paths
+from hats.pixel_math.healpix_pixel_function import get_pixel_argsort
+
+# Columns that keep double precision
+POSITION_TIME_COLUMNS = [
+    "ra",
+    "dec",
+    "raErr",
+    "decErr",
+    "x",
+    "y",
+    "xErr",
+    "yErr",
+    "coord_ra",
+    "coord_dec",
+    "coord_raErr",
+    "coord_decErr",
+    "midpointMjdTai",
+]
+
+# Completion markers of post-processing, kept in the catalog directory
+MARKER_DIR = ".post_processing"
+CATALOG_MARKER = "_SUCCESS"
+
+# AB magnitude of a 1 nJy source, i.e. -2.5 log10(1e-32 erg/s/cm^2/Hz) - 48.6
+AB_MAG_ZERO_POINT_NJY = 31.4
+
+
+def flux_to_mag(flux):
+    """AB magnitudes of fluxes in nJy; NaN for negative fluxes, inf for zero."""
+    log_flux = pc.log10(flux.cast(pa.float64()))
+    return pc.add(pc.multiply(log_flux, -2.5), AB_MAG_ZERO_POINT_NJY)
+
+
+def flux_err_to_mag_err(flux, flux_err):
+    """Half the magnitude difference between flux - fluxErr and flux + fluxErr.
+
+    The two logarithms are kept separate (rather than taking the log of their
+    ratio) so that the error is NaN whenever either bound is negative.
+    """
+    flux = flux.cast(pa.float64())
+    flux_err = flux_err.cast(pa.float64())
+    upper = pc.log10(pc.add(flux, flux_err))
+    lower = pc.log10(pc.subtract(flux, flux_err))
+    return pc.multiply(pc.subtract(upper, lower), 1.25)
+
+
+def append_mag_and_magerr(table, flux_col_prefixes):
+    """Append float32 magnitudes (and errors, if the flux has one) for flux columns."""
+    for prefix in flux_col_prefixes:
+        flux = table[f"{prefix}Flux"]
+        mag = flux_to_mag(flux).cast(pa.float32())
+        table = table.append_column(f"{prefix}Mag", mag)
+        flux_err_col = f"{prefix}FluxErr"
+        if flux_err_col in table.column_names:
+            mag_err = flux_err_to_mag_err(flux, table[flux_err_col])
+            table = table.append_column(f"{prefix}MagErr", mag_err.cast(pa.float32()))
+    return table
+
+
+def add_mjd_from_visit(table, visit_index):
+    """Add the MJD of every row from the visit index (null for unknown visits)."""
+    if "visit" not in table.column_names:
+        raise ValueError("`visit` column is missing")
+    if "midpointMjdTai" in table.column_names:
+        raise ValueError("`mjd` is already present in table")
+    mjds = visit_index.lookup(table["visit"], ["expMidptMJD"])["expMidptMJD"]
+    return table.append_column("midpointMjdTai", mjds)
+
+
+def cast_columns_float32(table):
+    """Cast non-positional / time columns to single-precision"""
+    schema = pa.schema(
+        [
+            (
+                field.with_type(pa.float32())
+                if field.type == pa.float64()
+                and field.name not in POSITION_TIME_COLUMNS
+                else field
+            )
+            for field in table.schema
+        ]
+    )
+    return table.cast(schema)
+
+
+def postprocess_table(table, flux_col_prefixes=(), visit_index=None):
+    """Apply all post-processing steps to a table (e.g. one row group)."""
+    if len(flux_col_prefixes) > 0:
+        table = append_mag_and_magerr(table, flux_col_prefixes)
+    if visit_index is not None:
+        table = add_mjd_from_visit(table, visit_index)
+    return cast_columns_float32(table).replace_schema_metadata()
+
+
+def is_postprocessed(schema, flux_col_prefixes=(), visit_index=None):
+    """Whether a file already has the columns that post-processing adds.
+
+    Files that are only cast to float32 cannot be told apart, but casting
+    them again is harmless.
+    """
+    added = [f"{prefix}Mag" for prefix in flux_col_prefixes]
+    if visit_index is not None:
+        added.append("midpointMjdTai")
+    return len(added) > 0 and all(name in schema.names for name in added)
+
+
+def rewrite_parquet_file(path, flux_col_prefixes=(), visit_index=None):
+    """Post-process a parquet file row group by row group, then replace it.
+
+    The output is streamed to a temporary file next to the original, which
+    is only swapped in once it is complete, so the file is either fully
+    processed or untouched. Files that were already processed are left as
+    they are. Returns the footer metadata of the (new) file.
+    """
+    path = str(path)
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    writer = None
+    try:
+        with pq.ParquetFile(path) as parquet_file:
+            if is_postprocessed(
+                parquet_file.schema_arrow, flux_col_prefixes, visit_index
+            ):
+                return parquet_file.metadata
+            num_row_groups = parquet_file.metadata.num_row_groups
+            for rg_index in range(max(num_row_groups, 1)):
+                if num_row_groups == 0:
+                    table = parquet_file.schema_arrow.empty_table()
+                else:
+                    table = parquet_file.read_row_group(rg_index)
+                table = postprocess_table(table, flux_col_prefixes, visit_index)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+        writer.close()
+        metadata = writer.writer.metadata
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return metadata
+
+
+def process_partition(catalog_dir, target_pixel, flux_col_prefixes, visit_index=None):
+    """Apply post-processing steps to each individual partition.
+
+    Returns the pixel and the footer metadata of its rewritten file, with the
+    file path set relative to the dataset directory, ready for _metadata.
+    The footer is also saved as the completion marker of the partition.
+    """
+    file_path = hats.io.pixel_catalog_file(catalog_dir, target_pixel)
+    metadata = rewrite_parquet_file(file_path.path, flux_col_prefixes, visit_index)
+    metadata.set_file_path(
+        os.path.relpath(file_path.path, os.path.join(catalog_dir, "dataset"))
+    )
+    write_marker(catalog_dir, target_pixel, metadata)
+    return target_pixel, metadata
+
+
+def marker_path(catalog_dir, pixel):
+    return os.path.join(
+        catalog_dir, MARKER_DIR, f"Norder={pixel.order}_Npix={pixel.pixel}.parquet"
+    )
+
+
+def write_marker(catalog_dir, pixel, metadata):
+    """Atomically record a finished partition, as a metadata-only parquet file."""
+    path = marker_path(catalog_dir, pixel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    metadata.write_metadata_file(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_markers(catalog_dir, pixels, max_workers=16):
+    """Footers of the partitions, among pixels, that are already post-processed."""
+    marker_dir = os.path.join(catalog_dir, MARKER_DIR)
+    if not os.path.isdir(marker_dir):
+        return {}
+    names = set(os.listdir(marker_dir))
+    done = [
+        pixel
+        for pixel in pixels
+        if os.path.basename(marker_path(catalog_dir, pixel)) in names
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        footers = executor.map(
+            lambda pixel: pq.read_metadata(marker_path(catalog_dir, pixel)), done
+        )
+        return dict(zip(done, footers))
+
+
+def is_catalog_postprocessed(catalog_dir):
+    return os.path.exists(os.path.join(catalog_dir, MARKER_DIR, CATALOG_MARKER))
+
+
+def mark_catalog_postprocessed(catalog_dir):
+    """Replace the partition markers of a catalog by a single catalog marker."""
+    marker_dir = os.path.join(catalog_dir, MARKER_DIR)
+    os.makedirs(marker_dir, exist_ok=True)
+    with open(os.path.join(marker_dir, CATALOG_MARKER), "w"):
+        pass
+    for name in os.listdir(marker_dir):
+        if name != CATALOG_MARKER:
+            os.remove(os.path.join(marker_dir, name))
+
+
+def write_catalog_metadata(catalog_dir, partition_footers):
+    """Write _metadata, _common_metadata and partition_info.csv of a catalog
+    from the (pixel, footer) pairs of all its partitions, without reading
+    any of the leaf files. Returns the total number of rows."""
+    pixels = [pixel for pixel, _ in partition_footers]
+    footers = [partition_footers[index][1] for index in get_pixel_argsort(pixels)]
+    schema = footers[0].schema.to_arrow_schema()
+    file_io.write_parquet_metadata(
+        schema,
+        paths.get_parquet_metadata_pointer(catalog_dir),
+        metadata_collector=footers,
+        write_statistics=True,
+    )
+    file_io.write_parquet_metadata(
+        schema, paths.get_common_metadata_pointer(catalog_dir)
+    )
+    PartitionInfo.from_healpix(pixels).write_to_file(
+        paths.get_partition_info_pointer(catalog_dir)
+    )
+    return sum(footer.num_rows for footer in footers)
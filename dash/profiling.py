@@ -0,0 +1,349 @@
+"""Resource profiles of the pipeline stages and of their named steps.
+
+When util/run_stages.py runs the pipeline, it profiles every stage, and
+steps of the notebooks wrapped in ``profile_step`` are profiled too. For
+each of them we record:
+
+- the CPU time, peak RSS and bytes read / written of the driver (the
+  notebook kernel and its children),
+- the same for the Dask workers, with the bytes they spilled to disk and
+  the number of tasks they executed,
+
+and save the Dask performance report of every step. Records are appended
+to JSON-lines files of the profile directory of the version, which are
+combined into profile.json at the end of the run, and compared with the
+profile of the previous version.
+
+Workers are shared by the stages running at the same time, so their
+counters for a stage also include the work of any overlapping stage
+(which is recorded alongside).
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import warnings
+from pathlib import Path
+
+import pandas as pd
+import psutil
+from dask.distributed import performance_report
+
+PROFILE_DIR_VARIABLE = "DASH_PROFILE_DIR"
+STAGE_VARIABLE = "DASH_STAGE"
+STAGES_FILE = "stages.jsonl"
+STEPS_FILE = "steps.jsonl"
+PROFILE_FILE = "profile.json"
+REPORTS_DIR = "reports"
+
+METRICS = [
+    "wall_seconds",
+    "driver_cpu_seconds",
+    "driver_peak_rss_bytes",
+    "driver_read_bytes",
+    "driver_write_bytes",
+    "worker_cpu_seconds",
+    "worker_peak_rss_bytes",
+    "worker_read_bytes",
+    "worker_write_bytes",
+    "worker_spilled_bytes",
+    "worker_tasks",
+]
+
+
+def _io_bytes(process):
+    """Bytes read and written by a process; zeros where psutil cannot tell
+    (e.g. on macOS)."""
+    if not hasattr(process, "io_counters"):
+        return 0, 0
+    io = process.io_counters()
+    return io.read_bytes, io.write_bytes
+
+
+class ProcessTreeSampler:
+    """Samples the CPU time, RSS and I/O of a process and of all its
+    children in a background thread, between start() and stop().
+
+    Counters of processes that exit between two samples are only known up
+    to their last sample.
+    """
+
+    def __init__(self, pid=None, interval=0.5):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.baseline = {}
+        self.latest = {}
+        self.peak_rss_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _counters(self):
+        counters = {}
+        try:
+            processes = [self.process] + self.process.children(recursive=True)
+        except psutil.Error:
+            return counters
+        for process in processes:
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_times()
+                    read_bytes, write_bytes = _io_bytes(process)
+                    counters[process.pid] = {
+                        "cpu_seconds": cpu.user + cpu.system,
+                        "rss_bytes": process.memory_info().rss,
+                        "read_bytes": read_bytes,
+                        "write_bytes": write_bytes,
+                    }
+            except psutil.Error:
+                continue
+        return counters
+
+    def sample(self):
+        counters = self._counters()
+        self.latest.update(counters)
+        self.peak_rss_bytes = max(
+            self.peak_rss_bytes, sum(c["rss_bytes"] for c in counters.values())
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.baseline = self._counters()
+        self.sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        return self.stats()
+
+    def stats(self):
+        totals = {"cpu_seconds": 0.0, "read_bytes": 0, "write_bytes": 0}
+        for pid, counters in self.latest.items():
+            baseline = self.baseline.get(pid, {})
+            for name in totals:
+                totals[name] += counters[name] - baseline.get(name, 0)
+        return {
+            "driver_cpu_seconds": totals["cpu_seconds"],
+            "driver_peak_rss_bytes": self.peak_rss_bytes,
+            "driver_read_bytes": totals["read_bytes"],
+            "driver_write_bytes": totals["write_bytes"],
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _worker_counters(dask_worker, since=None):
+    """Counters of a Dask worker process; run on every worker."""
+    process = psutil.Process()
+    cpu = process.cpu_times()
+    read_bytes, write_bytes = _io_bytes(process)
+    monitor = dask_worker.monitor
+    memory = [
+        rss
+        for rss, timestamp in zip(
+            monitor.quantities["memory"], monitor.quantities["time"]
+        )
+        if since is None or timestamp >= since
+    ]
+    return {
+        "cpu_seconds": cpu.user + cpu.system,
+        "rss_bytes": process.memory_info().rss,
+        "peak_rss_bytes": max(memory, default=process.memory_info().rss),
+        "read_bytes": read_bytes,
+        "write_bytes": write_bytes,
+        "spilled_bytes": sum(
+            value
+            for key, value in dask_worker.digests_total.items()
+            if isinstance(key, tuple) and key[-2:] == ("disk-write", "bytes")
+        ),
+        "tasks": dask_worker.state.executed_count,
+    }
+
+
+def cluster_counters(client, since=None):
+    """Counters of every worker of the cluster, by worker address."""
+    return client.run(_worker_counters, since=since)
+
+
+def cluster_usage(before, after):
+    """Resources used by the workers between two cluster_counters().
+
+    Workers that joined in between count from zero, and those that left
+    are not accounted for.
+    """
+    usage = {
+        "worker_cpu_seconds": 0.0,
+        "worker_peak_rss_bytes": 0,
+        "worker_read_bytes": 0,
+        "worker_write_bytes": 0,
+        "worker_spilled_bytes": 0,
+        "worker_tasks": 0,
+    }
+    for address, counters in after.items():
+        baseline = before.get(address, {})
+        for name in [
+            "cpu_seconds",
+            "read_bytes",
+            "write_bytes",
+            "spilled_bytes",
+            "tasks",
+        ]:
+            usage[f"worker_{name}"] += counters[name] - baseline.get(name, 0)
+        usage["worker_peak_rss_bytes"] = max(
+            usage["worker_peak_rss_bytes"], counters["peak_rss_bytes"]
+        )
+    return usage
+
+
+def append_record(path, record):
+    """Append a record to a JSON-lines file (one write, so that concurrent
+    stages do not interleave)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as _file:
+        _file.write(json.dumps(record) + "\n")
+
+
+@contextlib.contextmanager
+def saved_performance_report(filename):
+    """Dask performance report of the default client, saved to a file.
+
+    Unlike performance_report, failing to write the report only warns, so
+    that profiling never fails a stage.
+    """
+    report = performance_report(filename=str(filename))
+    report.__enter__()
+    try:
+        yield
+    finally:
+        try:
+            report.__exit__(None, None, None)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            warnings.warn(f"Could not write the performance report {filename}: {error}")
+
+
+@contextlib.contextmanager
+def profile_step(name, client=None):
+    """Profile a named step of a stage, along with the workers of the client.
+
+    Does nothing when the notebook is not run by util/run_stages.py (i.e.
+    when DASH_PROFILE_DIR is not set).
+    """
+    profile_dir = os.environ.get(PROFILE_DIR_VARIABLE)
+    if not profile_dir:
+        yield
+        return
+    stage = os.environ.get(STAGE_VARIABLE, "interactive")
+    record = {"stage": stage, "step": name, "start": time.time()}
+    sampler = ProcessTreeSampler().start()
+    before = cluster_counters(client) if client is not None else None
+    start_time = time.monotonic()
+    report = Path(profile_dir) / REPORTS_DIR / f"{stage}-{name}.html"
+    report.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with (
+            saved_performance_report(report)
+            if client is not None
+            else contextlib.nullcontext()
+        ):
+            yield
+        record["status"] = "succeeded"
+    except BaseException:
+        record["status"] = "failed"
+        raise
+    finally:
+        record["wall_seconds"] = time.monotonic() - start_time
+        record.update(sampler.stop())
+        if client is not None:
+            record.update(
+                cluster_usage(before, cluster_counters(client, since=record["start"]))
+            )
+            record["report"] = str(report.relative_to(profile_dir))
+        append_record(Path(profile_dir) / STEPS_FILE, record)
+
+
+def read_records(path):
+    """Records of a JSON-lines file, keeping the last one of every (stage,
+    step), e.g. when a stage was run again when resuming."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    records = {}
+    with path.open() as _file:
+        for line in _file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn final line from an interrupted run
+                continue
+            records[(record["stage"], record.get("step"))] = record
+    return list(records.values())
+
+
+def write_profile(profile_dir, version):
+    """Combine the stage and step records of a version into profile.json."""
+    profile_dir = Path(profile_dir)
+    stages = read_records(profile_dir / STAGES_FILE)
+    for stage in stages:
+        stage["overlapping"] = [
+            other["stage"]
+            for other in stages
+            if other is not stage
+            and other["start"] < stage["end"]
+            and stage["start"] < other["end"]
+        ]
+    profile = {
+        "version": version,
+        "stages": stages,
+        "steps": read_records(profile_dir / STEPS_FILE),
+    }
+    (profile_dir / PROFILE_FILE).write_text(json.dumps(profile, indent=1))
+    return profile
+
+
+def profile_frame(profile):
+    """Metrics of a profile, with a row per stage (step "") and per step."""
+    rows = [dict(record, step="") for record in profile["stages"]]
+    rows += profile["steps"]
+    frame = pd.DataFrame(rows, columns=["stage", "step"] + METRICS)
+    return frame.set_index(["stage", "step"]).sort_index()
+
+
+def find_previous_profile(log_root, version):
+    """Path of the profile of the latest version before this one, if any.
+
+    Versions (e.g. w_2025_49) are ordered as strings.
+    """
+    previous = sorted(
+        path
+        for path in Path(log_root).glob(f"*/profile/{PROFILE_FILE}")
+        if path.parents[1].name < version
+    )
+    return previous[-1] if previous else None
+
+
+def diff_profiles(previous, current):
+    """Metrics of two profiles side by side, with the ratio current / previous."""
+    previous_frame = profile_frame(previous)
+    current_frame = profile_frame(current)
+    diff = pd.concat(
+        {
+            previous["version"]: previous_frame.stack(future_stack=True),
+            current["version"]: current_frame.stack(future_stack=True),
+        },
+        axis=1,
+    )
+    diff.index.names = ["stage", "step", "metric"]
+    diff["ratio"] = diff[current["version"]] / diff[previous["version"]]
+    return diff
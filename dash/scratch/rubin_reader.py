@@ -73,9 +73,11 @@ class RubinParquetReader(ParquetReader):
     def process_forcedSourceTable(self, table):
         # Add the missing MJDs
         if "visit" in table.columns:
-            visit_map = self.kwargs["visit_map"]
-            mjds = list(map(lambda x: visit_map.get(x, 0.0), table["visit"]))
-            table["midpointMJDTai"] = pd.Series(mjds, index=table.index)
+            visit_index = self.kwargs["visit_index"]
+            mjds = visit_index.lookup(table["visit"], ["expMidptMJD"])["expMidptMJD"]
+            table["midpointMJDTai"] = pd.Series(
+                mjds.fill_null(0.0).to_numpy(), index=table.index
+            )
         if "psfFlux" in table.columns:
             table = append_mag_and_magerr(table, flux_col_prefixes=["psf"])
         return table
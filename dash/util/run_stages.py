@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Run the DASH pipeline stages, concurrently where their dependencies allow.
+
+This replaces the sequential loop over notebooks that 00-run.sh used to do.
+
+Notes:
+- Every stage is a notebook, executed with `jupyter nbconvert --execute`
+  into the log directory (outputs/$VERSION), as before.
+- Stages declare the stages they depend on, and the inputs and outputs they
+  read and write. A stage starts as soon as all of its dependencies are
+  done, with at most --max-parallel stages running at once.
+- All stages connect to one long-lived Dask cluster started here (see
+  cluster.get_client), instead of each starting and stopping its own.
+- A stage that already finished for this version (its done marker and all
+  of its outputs exist) is skipped, unless one of its dependencies had to
+  run again, or it is listed in --rerun. Rerunning 00-run.sh therefore
+  skips the stages of a failed run that completed. The others run again
+  from scratch: the outputs that a failed stage partly wrote have to be
+  removed first, as most stages do not overwrite them.
+- Stage runtimes are appended to runtimes.tsv as the stages finish.
+- Every stage, and the steps of the notebooks wrapped in
+  profiling.profile_step, are profiled (CPU time, peak RSS, I/O, Dask spill
+  and tasks) into the profile directory of the log directory, along with
+  their Dask performance reports. At the end, the profile is combined into
+  profile.json and compared with the one of the previous version in
+  profile_diff.tsv.
+- Exits non-zero if any stage failed; stages depending on it are not run.
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from cluster import SCHEDULER_ADDRESS_VARIABLE  # noqa: E402
+from dask.distributed import Client, LocalCluster  # noqa: E402
+from profiling import (  # noqa: E402
+    PROFILE_DIR_VARIABLE,
+    REPORTS_DIR,
+    STAGE_VARIABLE,
+    STAGES_FILE,
+    ProcessTreeSampler,
+    append_record,
+    cluster_counters,
+    cluster_usage,
+    diff_profiles,
+    find_previous_profile,
+    saved_performance_report,
+    write_profile,
+)
+
+STAGES_DIR = Path(__file__).resolve().parents[1]
+DONE_MARKERS_DIR = ".stages"
+RUNTIMES_FILE = "runtimes.tsv"
+RUNTIMES_FORMAT = "%-40s\t%-20s\n"
+PROFILE_DIR = "profile"
+PROFILE_DIFF_FILE = "profile_diff.tsv"
+# Stages slower than this, relative to the previous version, are reported
+REGRESSION_RATIO = 1.25
+
+CATALOGS = [
+    "dia_object",
+    "dia_source",
+    "dia_object_forced_source",
+    "object",
+    "source",
+    "object_forced_source",
+]
+COLLECTIONS = ["dia_object_collection", "object_collection"]
+
+
+@dataclasses.dataclass(frozen=True)
+class Stage:
+    """A notebook of the pipeline, with the paths it reads and writes.
+
+    Paths may use the {raw}, {hats} and {validation} directories of the
+    version, and {version} itself. Relative paths are relative to the
+    stages directory.
+    """
+
+    notebook: str
+    depends_on: tuple[str, ...] = ()
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return Path(self.notebook).stem
+
+
+STAGES = [
+    Stage(
+        "01-Butler.ipynb",
+        outputs=("{raw}/manifests", "{raw}/visit_table.parquet"),
+    ),
+    Stage(
+        "02-Raw_file_sizes.ipynb",
+        depends_on=("01-Butler",),
+        inputs=("{raw}/manifests",),
+        outputs=("{raw}/sizes", "{raw}/index"),
+    ),
+    Stage(
+        "03-Import.ipynb",
+        depends_on=("02-Raw_file_sizes",),
+        inputs=("{raw}/index",),
+        outputs=tuple(f"{{hats}}/{name}/hats.properties" for name in CATALOGS),
+    ),
+    Stage(
+        "04-Post_processing.ipynb",
+        depends_on=("03-Import",),
+        inputs=("{raw}/visit_table.parquet",)
+        + tuple(f"{{hats}}/{name}/hats.properties" for name in CATALOGS),
+        outputs=tuple(f"{{hats}}/{name}/.post_processing/_SUCCESS" for name in CATALOGS),
+    ),
+    # The light curve catalogs of 05 are moved into the collections by 07,
+    # so only its done marker tells that it finished
+    Stage(
+        "05-Nesting.ipynb",
+        depends_on=("04-Post_processing",),
+        inputs=tuple(f"{{hats}}/{name}/hats.properties" for name in CATALOGS),
+    ),
+    Stage(
+        "06.a-Basic_Statistics.ipynb",
+        depends_on=("04-Post_processing",),
+        inputs=tuple(f"{{hats}}/{name}/hats.properties" for name in CATALOGS),
+    ),
+    Stage(
+        "06.b-ByField.ipynb",
+        depends_on=("04-Post_processing",),
+        outputs=tuple(
+            f"{{validation}}/{name}_byfield.parquet"
+            for name in ["object_forced_source", "dia_source", "dia_object_forced_source"]
+        ),
+    ),
+    Stage(
+        "07-Generate_collections.ipynb",
+        depends_on=("05-Nesting",),
+        outputs=tuple(f"{{hats}}/{name}/collection.properties" for name in COLLECTIONS),
+    ),
+    Stage(
+        "08-Crossmatch_ZTF_PS1.ipynb",
+        depends_on=("07-Generate_collections",),
+        inputs=tuple(f"{{hats}}/{name}/collection.properties" for name in COLLECTIONS),
+        outputs=tuple(
+            f"{{hats}}/{collection}_collection/{collection}_lc_x_{survey}/hats.properties"
+            for collection in ["dia_object", "object"]
+            for survey in ["ztf_dr22", "ps1"]
+        ),
+    ),
+    Stage(
+        "09-Generate_JSON.ipynb",
+        depends_on=("07-Generate_collections", "08-Crossmatch_ZTF_PS1"),
+        inputs=tuple(f"{{hats}}/{name}/collection.properties" for name in COLLECTIONS),
+        outputs=("{version}.json",),
+    ),
+]
+
+
+class StageRunner:
+    """Runs the stages of one version, recording runtimes, profiles and done
+    markers. Worker usage is only profiled when given a client of the cluster
+    shared by the stages."""
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        version: str,
+        output_dir: Path,
+        log_dir: Path,
+        client: Client | None = None,
+    ):
+        self.stages = {stage.name: stage for stage in stages}
+        self.version = version
+        self.output_dir = output_dir
+        self.log_dir = log_dir
+        self.runtimes_file = log_dir / RUNTIMES_FILE
+        self.profile_dir = log_dir / PROFILE_DIR
+        self.client = client
+        for stage in stages:
+            unknown = set(stage.depends_on) - set(self.stages)
+            if unknown:
+                raise ValueError(f"{stage.name} depends on unknown stages {unknown}")
+
+    def resolve(self, path: str) -> Path:
+        resolved = Path(
+            path.format(
+                raw=self.output_dir / "raw" / self.version,
+                hats=self.output_dir / "hats" / self.version,
+                validation=self.output_dir / "validation" / self.version,
+                version=self.version,
+            )
+        )
+        return resolved if resolved.is_absolute() else STAGES_DIR / resolved
+
+    def done_marker(self, stage: Stage) -> Path:
+        return self.log_dir / DONE_MARKERS_DIR / f"{stage.name}.done"
+
+    def is_complete(self, stage: Stage) -> bool:
+        """Whether the stage finished for this version and its outputs are there."""
+        return self.done_marker(stage).exists() and all(
+            self.resolve(path).exists() for path in stage.outputs
+        )
+
+    def record_runtime(self, name: str, runtime: str) -> None:
+        if not self.runtimes_file.exists():
+            self.runtimes_file.write_text(RUNTIMES_FORMAT % ("Stage name", "Runtime (HH:MM:SS)"))
+        with self.runtimes_file.open("a") as _file:
+            _file.write(RUNTIMES_FORMAT % (name, runtime))
+
+    def execute(self, stage: Stage, env: dict[str, str]) -> float:
+        """Execute the notebook of a stage; returns its runtime in seconds."""
+        missing = [path for path in stage.inputs if not self.resolve(path).exists()]
+        if missing:
+            raise FileNotFoundError(
+                f"{stage.name} is missing inputs: {[str(self.resolve(path)) for path in missing]}"
+            )
+        env = dict(env, **{STAGE_VARIABLE: stage.name, PROFILE_DIR_VARIABLE: str(self.profile_dir)})
+        record = {"stage": stage.name, "start": time.time()}
+        before = cluster_counters(self.client) if self.client is not None else None
+        start_time = time.monotonic()
+        process = subprocess.Popen(
+            [
+                "jupyter",
+                "nbconvert",
+                "--to",
+                "notebook",
+                "--execute",
+                stage.notebook,
+                "--output",
+                stage.notebook,
+                "--output-dir",
+                str(self.log_dir),
+                "--log-level=CRITICAL",
+            ],
+            cwd=STAGES_DIR,
+            env=env,
+        )
+        with ProcessTreeSampler(process.pid) as sampler:
+            returncode = process.wait()
+        runtime = time.monotonic() - start_time
+        record.update(
+            end=time.time(),
+            status="failed" if returncode else "succeeded",
+            wall_seconds=runtime,
+            **sampler.stats(),
+        )
+        if self.client is not None:
+            record.update(
+                cluster_usage(before, cluster_counters(self.client, since=record["start"]))
+            )
+        append_record(self.profile_dir / STAGES_FILE, record)
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, process.args)
+        marker = self.done_marker(stage)
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        return runtime
+
+    def run(self, env: dict[str, str], max_parallel: int, rerun: set[str]) -> list[str]:
+        """Run all the stages; returns the names of those that failed."""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        start_time = time.monotonic()
+        pending = dict(self.stages)
+        executed: set[str] = set()
+        finished: set[str] = set()
+        failed: list[str] = []
+        running: dict[concurrent.futures.Future, Stage] = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            while pending or running:
+                num_pending = len(pending)
+                for name, stage in list(pending.items()):
+                    if any(dep in failed for dep in stage.depends_on):
+                        logging.error("Not running %s: a dependency failed", name)
+                        failed.append(pending.pop(name).name)
+                        continue
+                    if not all(dep in finished for dep in stage.depends_on):
+                        continue
+                    upstream_ran = any(dep in executed for dep in stage.depends_on)
+                    if name not in rerun and not upstream_ran and self.is_complete(stage):
+                        logging.info("Skipping %s: already complete", name)
+                        self.record_runtime(name, "skipped")
+                        finished.add(pending.pop(name).name)
+                        continue
+                    if len(running) < max_parallel:
+                        logging.info("Executing %s...", name)
+                        running[executor.submit(self.execute, stage, env)] = pending.pop(name)
+                if not running:
+                    if pending and len(pending) == num_pending:
+                        raise ValueError(f"Stages with circular dependencies: {list(pending)}")
+                    continue
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        runtime = future.result()
+                    except Exception as error:  # noqa: BLE001
+                        logging.error("%s failed: %s", stage.name, error)
+                        self.record_runtime(stage.name, "failed")
+                        failed.append(stage.name)
+                        continue
+                    logging.info("%s finished in %s", stage.name, format_runtime(runtime))
+                    self.record_runtime(stage.name, format_runtime(runtime))
+                    executed.add(stage.name)
+                    finished.add(stage.name)
+
+        total_runtime = format_runtime(time.monotonic() - start_time)
+        logging.info("Total runtime: %s", total_runtime)
+        self.record_runtime("Total_runtime", total_runtime)
+        self.write_profile()
+        return failed
+
+    def write_profile(self) -> None:
+        """Write profile.json, and its diff with the previous version."""
+        profile = write_profile(self.profile_dir, self.version)
+        previous_file = find_previous_profile(self.log_dir.parent, self.version)
+        if previous_file is None:
+            logging.info("No profile of a previous version to compare with")
+            return
+        previous = json.loads(previous_file.read_text())
+        diff = diff_profiles(previous, profile)
+        diff.to_csv(self.profile_dir / PROFILE_DIFF_FILE, sep="\t")
+        logging.info(
+            "Profile compared with %s in %s",
+            previous["version"],
+            self.profile_dir / PROFILE_DIFF_FILE,
+        )
+        stages = diff.xs(("", "wall_seconds"), level=("step", "metric"))
+        for name, row in stages[stages["ratio"] >= REGRESSION_RATIO].iterrows():
+            logging.warning(
+                "%s took %s, %.1fx the %s of %s",
+                name,
+                format_runtime(row[self.version]),
+                row["ratio"],
+                format_runtime(row[previous["version"]]),
+                previous["version"],
+            )
+
+
+def format_runtime(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the stages of the DASH pipeline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--version", default=os.getenv("VERSION"), required=True, help="Version string"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=os.getenv("OUTPUT_DIR"),
+        required=True,
+        help="Output directory root of the hats, raw and validation trees",
+    )
+    parser.add_argument(
+        "--log-dir",
+        help="Where executed notebooks and runtimes go (default: outputs/<version>)",
+    )
+    parser.add_argument(
+        "--max-parallel", type=int, default=3, help="Max stages running at once"
+    )
+    parser.add_argument(
+        "--rerun",
+        nargs="+",
+        default=[],
+        choices=[stage.name for stage in STAGES],
+        help="Stages to run even if they are complete",
+    )
+    parser.add_argument(
+        "--n-workers", type=int, default=16, help="Workers of the shared cluster"
+    )
+    parser.add_argument(
+        "--memory-limit", default="auto", help="Memory limit of each worker"
+    )
+    parser.add_argument(
+        "--no-shared-cluster",
+        action="store_true",
+        help="Let every stage start its own cluster, as when run on its own",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logging level",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level),
+        format="%(asctime)s | %(levelname)s | %(message)s",
+    )
+
+    log_dir = Path(args.log_dir or STAGES_DIR / "outputs" / args.version).resolve()
+    runner = StageRunner(STAGES, args.version, Path(args.output_dir).resolve(), log_dir)
+    env = dict(os.environ, VERSION=args.version, OUTPUT_DIR=args.output_dir)
+
+    if args.no_shared_cluster:
+        env.pop(SCHEDULER_ADDRESS_VARIABLE, None)
+        failed = runner.run(env, args.max_parallel, set(args.rerun))
+    else:
+        report = runner.profile_dir / REPORTS_DIR / "run.html"
+        report.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory() as tmp_dir, LocalCluster(
+            n_workers=args.n_workers,
+            threads_per_worker=1,
+            memory_limit=args.memory_limit,
+            local_directory=tmp_dir,
+        ) as cluster, Client(cluster) as client, saved_performance_report(report):
+            logging.info("Shared Dask cluster at %s", cluster.scheduler_address)
+            env[SCHEDULER_ADDRESS_VARIABLE] = cluster.scheduler_address
+            runner.client = client
+            failed = runner.run(env, args.max_parallel, set(args.rerun))
+
+    if failed:
+        logging.error("Stages failed: %s", ", ".join(failed))
+        raise SystemExit(1)
+    logging.info("DASH pipeline finished. Logs in %s.", log_dir)
+
+
+if __name__ == "__main__":
+    main()
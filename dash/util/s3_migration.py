@@ -8,30 +8,58 @@ then the migration is skipped.  The idea is to only migrate the files
 if they are older than the provided deadline.
 
 Notes:
-- Only deletes S3 objects after a successful download of the corresponding prefix.
+- Each prefix is listed exactly once; that single pass feeds the deadline
+  check, the download queue and the delete batches.
+- Only deletes an S3 object after its download has completed; deletions run
+  in batches while the rest of the prefix is still downloading.
+- Objects are downloaded concurrently by a bounded pool of --workers threads;
+  --max-concurrency only controls the multipart chunks of a single large object.
+- Progress of every prefix is persisted to a JSON-lines manifest next to its
+  destination directory, so an interrupted migration resumes without listing
+  the prefix again or re-checking the files that were already transferred.
+- With --verify, every local file is re-hashed (memory-mapped, in a pool of
+  processes) and compared against its S3 ETag, reconstructing multipart
+  ETags from the part size. Only verified objects are deleted from S3, and
+  verified entries are kept in the manifest so later runs skip re-hashing.
+  Objects encrypted with SSE-KMS or SSE-C do not have MD5 ETags and cannot
+  be verified; they are reported and kept both in S3 and locally.
 - Supports optional --dry-run to preview actions.
+- Supports --endpoint-url to run against an S3-compatible stand-in (MinIO, moto).
 - Exits non‑zero on any failed transfer.
 """
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
 import dataclasses
+import hashlib
+import json
 import logging
+import mmap
 import os
+import re
+from array import array
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from tqdm import tqdm
-from typing import Iterable
+from typing import Iterable, Iterator
 from zoneinfo import ZoneInfo
 
 import boto3
 from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
-from boto3.s3.transfer import TransferConfig, S3Transfer
+from boto3.s3.transfer import TransferConfig
 
 
 CATEGORIES = ("hats", "raw", "validation")
 PACIFIC = ZoneInfo("US/Pacific")
+MANIFEST_SUFFIX = ".manifest.jsonl"
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+# ETags that can be reproduced from the content: an MD5, or the multipart form
+MD5_ETAG = re.compile(r"[0-9a-f]{32}(-[0-9]+)?")
+# Verification outcome for objects whose ETag is not derived from an MD5
+UNVERIFIABLE = "unverifiable"
 
 
 def setup_logging(level: str) -> None:
@@ -61,17 +89,65 @@ def parse_iso8601(ts: str) -> datetime:
     return dt.astimezone(timezone.utc)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class S3Object:
     key: str
     size: int
     last_modified: datetime  # timezone-aware
+    etag: str = ""
 
 
-def list_objects(client, bucket: str, prefix: str) -> list[S3Object]:
+class ObjectListing:
+    """Array-backed listing of the objects under one prefix.
+
+    Sizes and modification times live in typed arrays and only keys and ETags
+    are kept as strings, so a prefix with millions of keys costs a fraction
+    of a list of S3Object records. Records are materialized on access only.
+    """
+
+    __slots__ = ("keys", "etags", "sizes", "mtimes")
+
+    def __init__(self):
+        self.keys: list[str] = []
+        self.etags: list[str] = []
+        self.sizes = array("q")
+        self.mtimes = array("d")  # POSIX timestamps, UTC
+
+    def append(self, obj: S3Object) -> None:
+        self.keys.append(obj.key)
+        self.etags.append(obj.etag)
+        self.sizes.append(obj.size)
+        self.mtimes.append(obj.last_modified.timestamp())
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, i: int) -> S3Object:
+        return S3Object(
+            key=self.keys[i],
+            size=self.sizes[i],
+            last_modified=datetime.fromtimestamp(self.mtimes[i], tz=timezone.utc),
+            etag=self.etags[i],
+        )
+
+    def __iter__(self) -> Iterator[S3Object]:
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.sizes)
+
+    def newest(self) -> datetime | None:
+        if not self.mtimes:
+            return None
+        return datetime.fromtimestamp(max(self.mtimes), tz=timezone.utc)
+
+
+def iter_object_pages(client, bucket: str, prefix: str) -> Iterator[list[S3Object]]:
+    """Yield the objects under prefix one listing page (<= 1000 keys) at a time."""
     paginator = client.get_paginator("list_objects_v2")
-    objects = []
     for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects = []
         for item in page.get("Contents", []):
             # Skip "directory" placeholders
             key = item["Key"]
@@ -83,17 +159,22 @@ def list_objects(client, bucket: str, prefix: str) -> list[S3Object]:
             else:
                 lm = lm.astimezone(timezone.utc)
             objects.append(
-                S3Object(key=key, size=item.get("Size", 0), last_modified=lm)
+                S3Object(
+                    key=key,
+                    size=item.get("Size", 0),
+                    last_modified=lm,
+                    etag=item.get("ETag", "").strip('"'),
+                )
             )
-    return objects
+        yield objects
 
 
-def newest_last_modified(objs: Iterable[S3Object]) -> datetime | None:
-    newest = None
-    for obj in objs:
-        if newest is None or obj.last_modified > newest:
-            newest = obj.last_modified
-    return newest
+def list_objects(client, bucket: str, prefix: str) -> ObjectListing:
+    listing = ObjectListing()
+    for page in iter_object_pages(client, bucket, prefix):
+        for obj in page:
+            listing.append(obj)
+    return listing
 
 
 def relative_key_path(key: str, base_prefix: str) -> str:
@@ -103,35 +184,476 @@ def relative_key_path(key: str, base_prefix: str) -> str:
     return rel
 
 
+def manifest_path_for(dest_dir: Path) -> Path:
+    """Location of the manifest for a destination, e.g. hats/.w_2025_49.manifest.jsonl"""
+    return dest_dir.parent / f".{dest_dir.name}{MANIFEST_SUFFIX}"
+
+
+class TransferManifest:
+    """Append-only JSON-lines record of the migration of one prefix.
+
+    The manifest first holds the full object listing (key, size, ETag and
+    last-modified time), streamed page by page and terminated by a ``listed``
+    marker, and a ``started`` marker once transfers from that listing have
+    begun. Every completed transfer then appends a ``done`` record with the
+    MD5 of the local file. Loading an existing manifest restores all of them,
+    so a resumed run neither lists the prefix again nor touches files that
+    were already transferred.
+
+    It doubles as the checksum index of the verification stage: ``verified``
+    records mark objects whose local file matched the ETag, and ``mismatch``
+    records revoke the ``done`` state so the object is transferred again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.listing = ObjectListing()
+        self.done: dict[str, tuple[int, str, str]] = {}  # key -> (size, etag, md5)
+        self.verified: set[str] = set()
+        self.listing_complete = False
+        self.transfer_started = False
+        if path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        with self.path.open("r", encoding="utf8") as _file:
+            for line in _file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from an interrupted run
+                    continue
+                kind = record.get("type")
+                if kind == "object":
+                    self.listing.append(
+                        S3Object(
+                            key=record["key"],
+                            size=record["size"],
+                            last_modified=datetime.fromisoformat(
+                                record["last_modified"]
+                            ),
+                            etag=record["etag"],
+                        )
+                    )
+                elif kind == "listed":
+                    self.listing_complete = True
+                elif kind == "started":
+                    self.transfer_started = True
+                elif kind == "done":
+                    self.done[record["key"]] = (
+                        record["size"],
+                        record["etag"],
+                        record["md5"],
+                    )
+                elif kind == "verified":
+                    self.verified.add(record["key"])
+                elif kind == "mismatch":
+                    self.done.pop(record["key"], None)
+                    self.verified.discard(record["key"])
+        logging.info(
+            "Loaded manifest %s (%d objects listed, %d done, %d verified)",
+            self.path,
+            len(self.listing),
+            len(self.done),
+            len(self.verified),
+        )
+
+    def _append(self, records: Iterable[dict]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf8") as _file:
+            for record in records:
+                _file.write(json.dumps(record) + "\n")
+            _file.flush()
+            os.fsync(_file.fileno())
+
+    def begin_listing(self) -> None:
+        """Discard any partial listing left behind by an interrupted run."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text("", encoding="utf8")
+        self.listing = ObjectListing()
+        self.done = {}
+        self.verified = set()
+        self.listing_complete = False
+        self.transfer_started = False
+
+    def record_objects(self, objs: list[S3Object]) -> None:
+        for obj in objs:
+            self.listing.append(obj)
+        self._append(
+            {
+                "type": "object",
+                "key": obj.key,
+                "size": obj.size,
+                "etag": obj.etag,
+                "last_modified": obj.last_modified.isoformat(),
+            }
+            for obj in objs
+        )
+
+    def finish_listing(self) -> None:
+        self.listing_complete = True
+        self._append([{"type": "listed", "count": len(self.listing)}])
+
+    def begin_transfer(self) -> None:
+        """Mark the listing as in use, so later runs resume from it."""
+        if not self.transfer_started:
+            self.transfer_started = True
+            self._append([{"type": "started"}])
+
+    def discard_listing(self) -> None:
+        """Forget a listing that no transfer has used yet."""
+        if self.transfer_started:
+            return
+        self.path.unlink(missing_ok=True)
+        self.listing = ObjectListing()
+        self.done = {}
+        self.verified = set()
+        self.listing_complete = False
+
+    def record_done(self, obj: S3Object, md5: str) -> None:
+        self.done[obj.key] = (obj.size, obj.etag, md5)
+        self._append(
+            [
+                {
+                    "type": "done",
+                    "key": obj.key,
+                    "size": obj.size,
+                    "etag": obj.etag,
+                    "md5": md5,
+                }
+            ]
+        )
+
+    def record_verified(self, obj: S3Object) -> None:
+        self.verified.add(obj.key)
+        self._append([{"type": "verified", "key": obj.key}])
+
+    def record_mismatch(self, obj: S3Object) -> None:
+        self.done.pop(obj.key, None)
+        self.verified.discard(obj.key)
+        self._append([{"type": "mismatch", "key": obj.key}])
+
+    def is_done(self, key: str, size: int, etag: str) -> bool:
+        record = self.done.get(key)
+        return record is not None and record[:2] == (size, etag)
+
+    def is_verified(self, key: str) -> bool:
+        return key in self.verified
+
+
+def scan_prefix(
+    client,
+    bucket: str,
+    prefix: str,
+    deadline: datetime,
+    manifest: TransferManifest | None,
+) -> ObjectListing | None:
+    """List prefix once, checking every object against the deadline on the way.
+
+    The listing is streamed into a compact ObjectListing (and the manifest, if
+    given) page by page. Returns None as soon as an object newer than the
+    deadline is seen, without listing the rest of the prefix.
+
+    A listing saved in the manifest is only reused once a transfer started
+    from it: that run already passed the deadline check and began deleting
+    sources, so it is finished from the same listing. Objects added to the
+    prefix since then are left in place for a later run. A listing that was
+    saved but never used is stale and the prefix is listed again.
+    """
+    if manifest is not None and manifest.listing_complete and manifest.transfer_started:
+        logging.info("Using manifest listing for s3://%s/%s", bucket, prefix)
+        listing = manifest.listing
+        newest = listing.newest()
+        if newest is not None and newest > deadline:
+            logging.info(
+                "Object under s3://%s/%s modified at %s, after the deadline",
+                bucket,
+                prefix,
+                newest.isoformat(),
+            )
+            return None
+        return listing
+
+    if manifest is not None:
+        manifest.begin_listing()
+    listing = ObjectListing()
+    for page in iter_object_pages(client, bucket, prefix):
+        for obj in page:
+            if obj.last_modified > deadline:
+                logging.info(
+                    "Object s3://%s/%s modified at %s, after the deadline",
+                    bucket,
+                    obj.key,
+                    obj.last_modified.isoformat(),
+                )
+                return None
+        if manifest is not None:
+            manifest.record_objects(page)
+        else:
+            for obj in page:
+                listing.append(obj)
+    if manifest is not None:
+        manifest.finish_listing()
+        listing = manifest.listing
+    return listing
+
+
+class TransferProgress:
+    """Object-rate and byte-rate progress bars for a batch of transfers."""
+
+    def __init__(self, total_objects: int, total_bytes: int, desc: str):
+        self.objects = tqdm(total=total_objects, unit="file", desc=desc, position=0)
+        self.bytes = tqdm(
+            total=total_bytes,
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            desc=desc,
+            position=1,
+        )
+
+    def update(self, obj: S3Object) -> None:
+        self.objects.update(1)
+        self.bytes.update(obj.size)
+
+    def close(self) -> None:
+        self.bytes.close()
+        self.objects.close()
+
+    def __enter__(self) -> TransferProgress:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class _HashingWriter:
+    """Write-only file wrapper that hashes every byte on its way to disk.
+
+    It deliberately has no ``seek``/``tell``, which makes s3transfer write the
+    parts of a multipart download strictly in order.
+    """
+
+    def __init__(self, fileobj, digest):
+        self.fileobj = fileobj
+        self.digest = digest
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        return self.fileobj.write(data)
+
+
+def file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with path.open("rb") as _file:
+        for chunk in iter(lambda: _file.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_object(
+    client, bucket: str, obj: S3Object, target: Path, transfer_config: TransferConfig
+) -> str:
+    """Download a single object to target, returning the MD5 of the local file.
+
+    Small objects are streamed with a single GET; objects above the multipart
+    threshold go through the managed (chunked) transfer. Data is written to a
+    ``.part`` file that is only renamed into place once complete.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".part")
+    digest = hashlib.md5()
+    with partial.open("wb") as _file:
+        writer = _HashingWriter(_file, digest)
+        if obj.size < transfer_config.multipart_threshold:
+            body = client.get_object(Bucket=bucket, Key=obj.key)["Body"]
+            for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+                writer.write(chunk)
+        else:
+            client.download_fileobj(bucket, obj.key, writer, Config=transfer_config)
+    os.replace(partial, target)
+    return digest.hexdigest()
+
+
+def local_etag(path: str, part_size: int | None) -> str:
+    """ETag S3 would report for the file at path, computed over a memory map.
+
+    Without a part size this is the MD5 of the whole file. With one, it is
+    the multipart form: the MD5 of the concatenated part digests, followed by
+    ``-<number of parts>``. Runs in a worker process of the Verifier.
+    """
+    with open(path, "rb") as _file:
+        if os.fstat(_file.fileno()).st_size == 0:
+            return hashlib.md5().hexdigest()
+        with (
+            mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            memoryview(mapped) as view,
+        ):
+            if part_size is None:
+                return hashlib.md5(view).hexdigest()
+            digests = [
+                hashlib.md5(view[start : start + part_size]).digest()
+                for start in range(0, len(view), part_size)
+            ]
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def has_md5_etag(head: dict) -> bool:
+    """Whether a HEAD response describes an object whose ETag is derived from
+    the MD5 of its content, i.e. one not encrypted with SSE-KMS or SSE-C."""
+    return (
+        head.get("ServerSideEncryption") not in ("aws:kms", "aws:kms:dsse")
+        and "SSECustomerAlgorithm" not in head
+    )
+
+
+class Verifier:
+    """Compare local files against their S3 ETags in a pool of processes.
+
+    For multipart ETags (``<md5>-<parts>``) the part size is read from the
+    source with a HEAD request for part 1, so the ETag can be reconstructed
+    from the local file exactly. The HEAD requests run in a pool of threads,
+    so that their latency overlaps with the hashing of other files.
+
+    Objects whose ETag is not an MD5 of their content (SSE-KMS or SSE-C,
+    or a multipart layout other than equal parts) resolve to UNVERIFIABLE
+    instead of a local ETag, so they are not mistaken for corrupt copies.
+    """
+
+    def __init__(self, client, bucket: str, *, workers: int | None = None):
+        self.client = client
+        self.bucket = bucket
+        workers = workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        # Enough threads to keep the processes busy while others wait on HEADs
+        self.heads = concurrent.futures.ThreadPoolExecutor(max_workers=2 * workers)
+
+    def submit(self, obj: S3Object, path: Path) -> concurrent.futures.Future:
+        """Start verifying obj; the future resolves to the local ETag, to
+        UNVERIFIABLE, or to None if the source is already gone and there is
+        nothing to verify against."""
+        return self.heads.submit(self._verify, obj, path)
+
+    def _head(self, obj: S3Object, **kwargs) -> dict | None:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=obj.key, **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+                raise
+            return None
+
+    def _verify(self, obj: S3Object, path: Path) -> str | None:
+        if not MD5_ETAG.fullmatch(obj.etag):
+            return UNVERIFIABLE
+        part_size = None
+        if "-" in obj.etag:
+            head = self._head(obj, PartNumber=1)
+            if head is None:
+                return None
+            part_size = head["ContentLength"]
+            parts = int(obj.etag.rsplit("-", 1)[1])
+            if not has_md5_etag(head) or -(-obj.size // part_size) != parts:
+                return UNVERIFIABLE
+        etag = self.executor.submit(local_etag, str(path), part_size).result()
+        if etag != obj.etag and part_size is None:
+            # Single-part ETags of encrypted objects look like MD5s but are not
+            head = self._head(obj)
+            if head is None:
+                return None
+            if not has_md5_etag(head):
+                return UNVERIFIABLE
+        return etag
+
+    def close(self) -> None:
+        # Pending verifications still submit to the process pool
+        self.heads.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
+
+class BatchDeleter:
+    """Delete keys in batches of up to ``batch_size`` from a background thread.
+
+    Keys are queued as soon as their download completes, so ``delete_objects``
+    requests overlap with the transfers that are still running.
+    """
+
+    def __init__(self, client, bucket: str, *, batch_size: int = 1000):
+        self.client = client
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.pending: list[str] = []
+        self.futures: list[concurrent.futures.Future] = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def add(self, key: str) -> None:
+        self.pending.append(key)
+        if len(self.pending) >= self.batch_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        batch, self.pending = self.pending, []
+        self.futures.append(self.executor.submit(self._delete_batch, batch))
+
+    def _delete_batch(self, keys: list[str]) -> int:
+        batch = {"Objects": [{"Key": key} for key in keys], "Quiet": True}
+        try:
+            resp = self.client.delete_objects(Bucket=self.bucket, Delete=batch)
+        except (BotoCoreError, ClientError) as e:
+            logging.error("Delete batch failed: %s", e)
+            raise
+        # Quiet mode only reports the keys that could not be deleted
+        errors = resp.get("Errors", [])
+        for err in errors:
+            logging.error("Failed to delete %s: %s", err.get("Key"), err.get("Message"))
+        return len(keys) - len(errors)
+
+    def close(self) -> int:
+        """Flush the last partial batch and wait; returns number of deleted keys."""
+        if self.pending:
+            self._submit()
+        self.executor.shutdown(wait=True)
+        return sum(future.result() for future in self.futures)
+
+
 def download_prefix(
     client,
     bucket: str,
     prefix: str,
+    listing: ObjectListing,
     dest_dir: Path,
     *,
+    workers: int,
     max_concurrency: int,
     dry_run: bool,
+    manifest: TransferManifest | None = None,
+    deleter: BatchDeleter | None = None,
+    verifier: Verifier | None = None,
 ) -> int:
-    """Download all objects under prefix to dest_dir.
+    """Download all listed objects under prefix to dest_dir.
+
+    Objects are transferred by a pool of ``workers`` threads, with at most
+    twice that many requests queued at once. Completed transfers are recorded
+    in the manifest (if given) and skipped on later runs. Every object that is
+    safely on local disk is handed to the deleter (if given).
+
+    With a verifier, objects only reach the deleter once their local file has
+    matched the ETag; objects that fail verification are reported as an error
+    and marked for transfer on the next run.
 
     Returns number of objects downloaded.
     """
-    transfer = S3Transfer(
-        client,
-        config=TransferConfig(
-            max_concurrency=max_concurrency, multipart_threshold=16 * 1024 * 1024
-        ),
+    transfer_config = TransferConfig(
+        max_concurrency=max_concurrency, multipart_threshold=MULTIPART_THRESHOLD
     )
-    objs = list_objects(client, bucket, prefix)
 
-    if not objs:
+    if not listing:
         logging.info("No objects under s3://%s/%s", bucket, prefix)
         return 0
 
     logging.info(
         "Planning to download %d objects (%.2f MiB) from s3://%s/%s to %s",
-        len(objs),
-        sum(obj.size for obj in objs) / 1024**2,
+        len(listing),
+        listing.total_size / 1024**2,
         bucket,
         prefix,
         dest_dir,
@@ -140,68 +662,145 @@ def download_prefix(
     dest_dir.mkdir(parents=True, exist_ok=True)
 
     if dry_run:
-        for obj in tqdm(objs, unit="file"):
+        for key in tqdm(listing.keys, unit="file"):
             logging.info(
-                "DRY-RUN download -> %s", dest_dir / relative_key_path(obj.key, prefix)
+                "DRY-RUN download -> %s", dest_dir / relative_key_path(key, prefix)
             )
         return 0
 
-    def _download(obj: S3Object):
-        f_downloaded = 0
-        rel = relative_key_path(obj.key, prefix)
-        target = dest_dir / rel
-        target.parent.mkdir(parents=True, exist_ok=True)
+    def _target(obj: S3Object) -> Path:
+        return dest_dir / relative_key_path(obj.key, prefix)
+
+    def _download(obj: S3Object) -> str:
+        target = _target(obj)
         try:
+            # Files from a run that predates the manifest only need hashing
             if target.exists() and target.stat().st_size == obj.size:
-                pass
-            else:
-                transfer.download_file(bucket, obj.key, str(target))
-            f_downloaded += 1
+                return file_md5(target)
+            return download_object(client, bucket, obj, target, transfer_config)
         except Exception as e:
             logging.error(
                 "Failed to download s3://%s/%s -> %s: %s", bucket, obj.key, target, e
             )
             raise
-        return f_downloaded
-
-    downloaded = 0
 
-    for obj in tqdm(objs, unit="file"):
-        downloaded += _download(obj)
+    def _transferred(obj: S3Object) -> None:
+        """Hand a locally complete object on to verification or deletion."""
+        if verifier is not None and not (
+            manifest is not None and manifest.is_verified(obj.key)
+        ):
+            in_flight[verifier.submit(obj, _target(obj))] = ("verify", obj)
+        elif deleter is not None:
+            deleter.add(obj.key)
+
+    if manifest is not None:
+        manifest.begin_transfer()
+    in_flight = {}
+    # Indices of the objects still to transfer, as a compact array
+    pending = array("q")
+    for i, (key, size, etag) in enumerate(
+        zip(listing.keys, listing.sizes, listing.etags)
+    ):
+        if manifest is not None and manifest.is_done(key, size, etag):
+            # Transferred by an earlier run, possibly without its source deleted
+            _transferred(listing[i])
+        else:
+            pending.append(i)
+    if manifest is not None:
+        logging.info(
+            "Manifest: %d of %d objects already transferred",
+            len(listing) - len(pending),
+            len(listing),
+        )
 
+    downloaded = len(listing) - len(pending)
+    mismatched = 0
+    unverifiable = 0
+    first_error = None
+    todo = (listing[i] for i in pending)
+    with (
+        TransferProgress(
+            len(pending), sum(listing.sizes[i] for i in pending), prefix
+        ) as progress,
+        concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor,
+    ):
+        while True:
+            # Keep the queue bounded instead of submitting every object up front
+            while first_error is None and len(in_flight) < 2 * workers:
+                obj = next(todo, None)
+                if obj is None:
+                    break
+                in_flight[executor.submit(_download, obj)] = ("download", obj)
+            if not in_flight:
+                break
+            finished, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                stage, obj = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Let in-flight transfers finish so the manifest stays useful
+                    first_error = first_error or e
+                    continue
+                if stage == "download":
+                    if manifest is not None:
+                        manifest.record_done(obj, result)
+                    progress.update(obj)
+                    downloaded += 1
+                    _transferred(obj)
+                elif result is None:
+                    logging.warning(
+                        "Cannot verify %s: source no longer exists", obj.key
+                    )
+                elif result == UNVERIFIABLE:
+                    # Both copies are kept; only a verified object is deleted
+                    logging.warning(
+                        "Cannot verify s3://%s/%s: ETag %s is not an MD5 of its "
+                        "content; keeping the source",
+                        bucket,
+                        obj.key,
+                        obj.etag,
+                    )
+                    unverifiable += 1
+                elif result == obj.etag:
+                    if manifest is not None:
+                        manifest.record_verified(obj)
+                    if deleter is not None:
+                        deleter.add(obj.key)
+                else:
+                    logging.error(
+                        "Checksum mismatch for s3://%s/%s: local %s, ETag %s",
+                        bucket,
+                        obj.key,
+                        result,
+                        obj.etag,
+                    )
+                    # Remove the bad copy so the next run transfers it again
+                    _target(obj).unlink(missing_ok=True)
+                    if manifest is not None:
+                        manifest.record_mismatch(obj)
+                    mismatched += 1
+
+    if unverifiable:
+        logging.warning(
+            "%d objects under %s could not be verified and were kept in S3",
+            unverifiable,
+            prefix,
+        )
+    if first_error is not None:
+        raise first_error
+    if mismatched:
+        raise RuntimeError(f"{mismatched} objects under {prefix} failed verification")
     return downloaded
 
 
-def delete_prefix(
-    client, bucket: str, prefix: str, *, dry_run: bool, batch_size: int = 1000
-) -> int:
-    objs = list_objects(client, bucket, prefix)
-    if not objs:
-        logging.info("No objects to delete under s3://%s/%s", bucket, prefix)
-        return 0
-
-    if dry_run:
-        for obj in tqdm(objs):
-            logging.info("DRY-RUN delete -> s3://%s/%s", bucket, obj.key)
-        return 0
-
-    deleted = 0
-    keys = [{"Key": obj.key} for obj in objs]
-    for i in tqdm(list(range(0, len(keys), batch_size)), unit="batch"):
-        batch = {"Objects": keys[i : i + batch_size], "Quiet": True}
-        try:
-            resp = client.delete_objects(Bucket=bucket, Delete=batch)
-            deleted += len(resp.get("Deleted", []))
-            errors = resp.get("Errors", [])
-            for err in errors:
-                logging.error(
-                    "Failed to delete %s: %s", err.get("Key"), err.get("Message")
-                )
-        except (BotoCoreError, ClientError) as e:
-            logging.error("Delete batch failed: %s", e)
-            raise
-    logging.info("Deleted %d objects under s3://%s/%s", deleted, bucket, prefix)
-    return deleted
+def _discard_listings(plans) -> None:
+    """Drop the saved listings of the prefixes that no transfer has used."""
+    for _, _, _, manifest in plans:
+        if manifest is not None:
+            manifest.discard_listing()
 
 
 def migrate(
@@ -210,69 +809,93 @@ def migrate(
     version: str,
     output_dir: Path,
     given_deadline: str,
+    workers: int,
     max_concurrency: int,
     dry_run: bool,
+    *,
+    verify: bool = False,
+    verify_workers: int | None = None,
 ) -> int:
     """
     Migrates data from the given S3 bucket to the given output directory,
     returning the total number of overall failures.
+
+    Every prefix is listed exactly once: the same pass gates on the deadline
+    and provides the download plan, and sources are deleted in batches while
+    the remaining downloads are still running.
     """
     plans = []
     for cat in CATEGORIES:
         prefix = f"{cat}/{version}/"
         dest = output_dir / cat / version
-        plans.append((cat, prefix, dest))
+        manifest = None if dry_run else TransferManifest(manifest_path_for(dest))
+        plans.append((cat, prefix, dest, manifest))
 
     # Deadline gating across all prefixes
     deadline = parse_iso8601(given_deadline)
     logging.info("Deadline set to %s (UTC)", deadline.isoformat())
-    newest_each = []
-    for _, prefix, _ in plans:
-        objs = list_objects(s3_client, bucket, prefix)
-        newest = newest_last_modified(objs)
+    listings = []
+    for _, prefix, _, manifest in plans:
+        listing = scan_prefix(s3_client, bucket, prefix, deadline, manifest)
+        if listing is None:
+            logging.info(
+                "Found objects newer than deadline %s; skipping migration.",
+                deadline.isoformat(),
+            )
+            _discard_listings(plans)
+            return 0
+        newest = listing.newest()
         if newest is not None:
-            newest_each.append(newest)
             logging.info(
                 "Newest under s3://%s/%s -> %s", bucket, prefix, newest.isoformat()
             )
         else:
             logging.info("No objects under s3://%s/%s", bucket, prefix)
-    newest_overall = max(newest_each) if newest_each else None
-    if newest_overall is None:
+        listings.append(listing)
+    if not any(listings):
         logging.info("Nothing to migrate; skipping.")
-        return 0
-    if newest_overall > deadline:
-        logging.info(
-            "Newest object %s is newer than deadline %s; skipping migration.",
-            newest_overall.isoformat(),
-            deadline.isoformat(),
-        )
+        _discard_listings(plans)
         return 0
 
     # Perform migrations per prefix
     overall_failures = 0
-    for cat, prefix, dest in plans:
+    for (cat, prefix, dest, manifest), listing in zip(plans, listings):
         logging.info("Migrating %s to %s...", prefix, dest)
+        deleter = None if dry_run else BatchDeleter(s3_client, bucket)
+        verifier = None
+        if verify and not dry_run:
+            verifier = Verifier(s3_client, bucket, workers=verify_workers)
         try:
-            downloaded = download_prefix(
-                s3_client,
-                bucket,
-                prefix,
-                dest,
-                max_concurrency=max_concurrency,
-                dry_run=dry_run,
-            )
+            try:
+                downloaded = download_prefix(
+                    s3_client,
+                    bucket,
+                    prefix,
+                    listing,
+                    dest,
+                    workers=workers,
+                    max_concurrency=max_concurrency,
+                    dry_run=dry_run,
+                    manifest=manifest,
+                    deleter=deleter,
+                    verifier=verifier,
+                )
+            finally:
+                if verifier is not None:
+                    verifier.close()
+                # Sources of completed downloads are deleted even on failure
+                deleted = deleter.close() if deleter is not None else 0
             if dry_run:
                 continue
             logging.info("%s: downloaded %d objects successfully.", prefix, downloaded)
-            # Safe to delete this prefix now
-            logging.info("Emptying %s from s3://%s/%s...", version, bucket, prefix)
-            delete_prefix(s3_client, bucket, prefix, dry_run=dry_run)
+            logging.info("Deleted %d objects under s3://%s/%s", deleted, bucket, prefix)
         except Exception as e:
             logging.error("Migration failed for %s: %s", prefix, e)
             overall_failures += 1
             break
 
+    # Prefixes that were never reached are listed again by the next run
+    _discard_listings(plans)
     return overall_failures
 
 
@@ -292,6 +915,10 @@ def main():
     )
     parser.add_argument("--bucket", default="rubin-lincc-hats", help="S3 bucket name")
     parser.add_argument("--profile", help="AWS profile name (optional)")
+    parser.add_argument(
+        "--endpoint-url",
+        help="S3-compatible endpoint (e.g. a local MinIO or moto server)",
+    )
 
     # Compute default deadline, which is 1 month prior to today.
     default_deadline = (
@@ -308,11 +935,28 @@ def main():
         action="store_true",
         help="Show planned actions without executing them",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=32,
+        help="Number of objects transferred concurrently",
+    )
     parser.add_argument(
         "--max-concurrency",
         type=int,
         default=min(4, (os.cpu_count() or 4) * 4),
-        help="Max concurrent transfers",
+        help="Max concurrent chunks within a single multipart transfer",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check every local file against its ETag before deleting the source",
+    )
+    parser.add_argument(
+        "--verify-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes hashing local files for --verify",
     )
     parser.add_argument(
         "--log-level",
@@ -327,7 +971,12 @@ def main():
     # Prepare AWS client
     session = boto3.session.Session(profile_name=args.profile)
     s3_client = session.client(
-        "s3", config=Config(retries={"max_attempts": 10, "mode": "adaptive"})
+        "s3",
+        endpoint_url=args.endpoint_url,
+        config=Config(
+            retries={"max_attempts": 10, "mode": "adaptive"},
+            max_pool_connections=args.workers * args.max_concurrency,
+        ),
     )
 
     overall_failures = migrate(
@@ -336,8 +985,11 @@ def main():
         args.version,
         Path(args.output_dir).resolve(),
         args.deadline,
+        args.workers,
         args.max_concurrency,
         args.dry_run,
+        verify=args.verify,
+        verify_workers=args.verify_workers,
     )
 
     if overall_failures:
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Upload the local outputs of a DASH run to S3, then remove the local copies.
+
+This is the counterpart of s3_migration.py and replaces the sequential
+`aws s3 cp --recursive` calls that used to end 00-run.sh.
+
+Notes:
+- The hats, raw and validation trees of a version are uploaded concurrently
+  by a single pool of --workers threads.
+- Small files are sent with a single PUT; files above --multipart-threshold
+  are uploaded in --multipart-chunksize parts, --max-concurrency at a time.
+- Progress of every tree is persisted to a JSON-lines manifest next to it,
+  so an interrupted upload resumes with the files that were not sent yet.
+- Local data is only deleted after listing the destination prefixes confirms
+  that every file landed with the expected size.
+- Supports optional --dry-run to preview actions.
+- Exits non‑zero on any failed transfer.
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Iterator
+
+import boto3
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+
+from s3_migration import (
+    CATEGORIES,
+    TransferProgress,
+    iter_object_pages,
+    setup_logging,
+)
+
+UPLOAD_MANIFEST_SUFFIX = ".upload.jsonl"
+MiB = 1024 * 1024
+
+
+def upload_manifest_path_for(source_dir: Path) -> Path:
+    """Location of the manifest for a source, e.g. hats/.w_2025_49.upload.jsonl"""
+    return source_dir.parent / f".{source_dir.name}{UPLOAD_MANIFEST_SUFFIX}"
+
+
+class UploadManifest:
+    """Append-only JSON-lines record of the files uploaded from one tree.
+
+    Every completed upload appends the key, size and modification time of
+    the local file along with the ETag returned by S3. A file is skipped on
+    later runs as long as its size and modification time are unchanged.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.uploaded: dict[str, tuple[int, int]] = {}  # key -> (size, mtime_ns)
+        if path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        with self.path.open("r", encoding="utf8") as _file:
+            for line in _file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from an interrupted run
+                    continue
+                self.uploaded[record["key"]] = (record["size"], record["mtime_ns"])
+        logging.info(
+            "Loaded manifest %s (%d files uploaded)", self.path, len(self.uploaded)
+        )
+
+    def record_uploaded(self, upload: LocalFile, etag: str) -> None:
+        self.uploaded[upload.key] = (upload.size, upload.mtime_ns)
+        record = {
+            "key": upload.key,
+            "size": upload.size,
+            "mtime_ns": upload.mtime_ns,
+            "etag": etag,
+        }
+        with self.path.open("a", encoding="utf8") as _file:
+            _file.write(json.dumps(record) + "\n")
+
+    def is_uploaded(self, upload: LocalFile) -> bool:
+        return self.uploaded.get(upload.key) == (upload.size, upload.mtime_ns)
+
+
+@dataclasses.dataclass(slots=True)
+class LocalFile:
+    """A file to upload, with the key it will have in the bucket."""
+
+    path: Path
+    key: str
+    size: int
+    mtime_ns: int
+
+
+def walk_files(source_dir: Path, prefix: str) -> Iterator[LocalFile]:
+    """Yield every regular file under source_dir, keyed below prefix."""
+    stack = [source_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.is_file():
+                    path = Path(entry.path)
+                    key = prefix + path.relative_to(source_dir).as_posix()
+                    stat = entry.stat()
+                    yield LocalFile(path, key, stat.st_size, stat.st_mtime_ns)
+
+
+def upload_file(
+    client, bucket: str, upload: LocalFile, transfer_config: TransferConfig
+) -> str:
+    """Upload a single file, returning the ETag of the new object."""
+    if upload.size < transfer_config.multipart_threshold:
+        with upload.path.open("rb") as _file:
+            resp = client.put_object(Bucket=bucket, Key=upload.key, Body=_file)
+        return resp["ETag"].strip('"')
+    client.upload_file(str(upload.path), bucket, upload.key, Config=transfer_config)
+    return client.head_object(Bucket=bucket, Key=upload.key)["ETag"].strip('"')
+
+
+def upload_trees(
+    client,
+    bucket: str,
+    plans: list[tuple[Path, str, UploadManifest | None]],
+    *,
+    workers: int,
+    transfer_config: TransferConfig,
+    dry_run: bool,
+) -> int:
+    """Upload every (source_dir, prefix, manifest) plan through one shared pool.
+
+    Files from all trees are interleaved in the same queue, which is bounded
+    to twice the number of workers. Returns number of files uploaded.
+    """
+    todo: list[tuple[LocalFile, UploadManifest | None]] = []
+    skipped = 0
+    for source_dir, prefix, manifest in plans:
+        if not source_dir.is_dir():
+            logging.info("No local directory %s; skipping", source_dir)
+            continue
+        for upload in walk_files(source_dir, prefix):
+            if manifest is not None and manifest.is_uploaded(upload):
+                skipped += 1
+            elif dry_run:
+                logging.info(
+                    "DRY-RUN upload %s -> s3://%s/%s", upload.path, bucket, upload.key
+                )
+            else:
+                todo.append((upload, manifest))
+    logging.info(
+        "Planning to upload %d files (%.2f MiB) to s3://%s; %d already uploaded",
+        len(todo),
+        sum(upload.size for upload, _ in todo) / MiB,
+        bucket,
+        skipped,
+    )
+    if dry_run:
+        return 0
+
+    uploaded = skipped
+    first_error = None
+    queue = iter(todo)
+    in_flight = {}
+    with (
+        TransferProgress(
+            len(todo), sum(upload.size for upload, _ in todo), "upload"
+        ) as progress,
+        concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor,
+    ):
+        while True:
+            while first_error is None and len(in_flight) < 2 * workers:
+                item = next(queue, None)
+                if item is None:
+                    break
+                future = executor.submit(
+                    upload_file, client, bucket, item[0], transfer_config
+                )
+                in_flight[future] = item
+            if not in_flight:
+                break
+            finished, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                upload, manifest = in_flight.pop(future)
+                try:
+                    etag = future.result()
+                except Exception as e:
+                    logging.error(
+                        "Failed to upload %s -> s3://%s/%s: %s",
+                        upload.path,
+                        bucket,
+                        upload.key,
+                        e,
+                    )
+                    # Let in-flight transfers finish so the manifest stays useful
+                    first_error = first_error or e
+                    continue
+                if manifest is not None:
+                    manifest.record_uploaded(upload, etag)
+                progress.update(upload)
+                uploaded += 1
+
+    if first_error is not None:
+        raise first_error
+    return uploaded
+
+
+def confirm_landed(client, bucket: str, source_dir: Path, prefix: str) -> bool:
+    """Check that every file under source_dir is listed under prefix with its size."""
+    expected = {upload.key: upload.size for upload in walk_files(source_dir, prefix)}
+    for page in iter_object_pages(client, bucket, prefix):
+        for obj in page:
+            if expected.get(obj.key) == obj.size:
+                del expected[obj.key]
+    for key in list(expected)[:10]:
+        logging.error("Missing or incomplete: s3://%s/%s", bucket, key)
+    if expected:
+        logging.error(
+            "%d files under %s did not land in s3://%s/%s",
+            len(expected),
+            source_dir,
+            bucket,
+            prefix,
+        )
+    return not expected
+
+
+def upload_version(
+    s3_client,
+    bucket: str,
+    version: str,
+    output_dir: Path,
+    *,
+    workers: int,
+    transfer_config: TransferConfig,
+    keep_local: bool,
+    dry_run: bool,
+) -> int:
+    """
+    Uploads the given version from the output directory to the given S3 bucket,
+    returning the total number of overall failures.
+    """
+    plans = []
+    for cat in CATEGORIES:
+        source = output_dir / cat / version
+        manifest = None if dry_run else UploadManifest(upload_manifest_path_for(source))
+        plans.append((source, f"{cat}/{version}/", manifest))
+
+    try:
+        uploaded = upload_trees(
+            s3_client,
+            bucket,
+            plans,
+            workers=workers,
+            transfer_config=transfer_config,
+            dry_run=dry_run,
+        )
+    except Exception as e:
+        logging.error("Upload failed: %s", e)
+        return 1
+    if dry_run:
+        return 0
+    logging.info("Uploaded %d files successfully.", uploaded)
+
+    overall_failures = 0
+    for source, prefix, _ in plans:
+        if not source.is_dir():
+            continue
+        if not confirm_landed(s3_client, bucket, source, prefix):
+            overall_failures += 1
+        elif not keep_local:
+            logging.info("Removing %s from temporary local storage...", source)
+            shutil.rmtree(source)
+    return overall_failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upload the outputs of a DASH run to S3.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--version", default=os.getenv("VERSION"), required=True, help="Version string"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=os.getenv("OUTPUT_DIR"),
+        required=True,
+        help="Local output directory root",
+    )
+    parser.add_argument("--bucket", default="rubin-lincc-hats", help="S3 bucket name")
+    parser.add_argument("--profile", help="AWS profile name (optional)")
+    parser.add_argument(
+        "--endpoint-url",
+        help="S3-compatible endpoint (e.g. a local MinIO or moto server)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=32,
+        help="Number of files uploaded concurrently",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="Max concurrent parts within a single multipart upload",
+    )
+    parser.add_argument(
+        "--multipart-threshold",
+        type=int,
+        default=64,
+        help="Size (MiB) above which files are uploaded in parts",
+    )
+    parser.add_argument(
+        "--multipart-chunksize",
+        type=int,
+        default=64,
+        help="Part size (MiB) of multipart uploads",
+    )
+    parser.add_argument(
+        "--keep-local",
+        action="store_true",
+        help="Do not remove local data after a confirmed upload",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show planned actions without executing them",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logging level",
+    )
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+
+    # Prepare AWS client
+    session = boto3.session.Session(profile_name=args.profile)
+    s3_client = session.client(
+        "s3",
+        endpoint_url=args.endpoint_url,
+        config=Config(
+            retries={"max_attempts": 10, "mode": "adaptive"},
+            max_pool_connections=args.workers * args.max_concurrency,
+        ),
+    )
+    transfer_config = TransferConfig(
+        multipart_threshold=args.multipart_threshold * MiB,
+        multipart_chunksize=args.multipart_chunksize * MiB,
+        max_concurrency=args.max_concurrency,
+    )
+
+    overall_failures = upload_version(
+        s3_client,
+        args.bucket,
+        args.version,
+        Path(args.output_dir).resolve(),
+        workers=args.workers,
+        transfer_config=transfer_config,
+        keep_local=args.keep_local,
+        dry_run=args.dry_run,
+    )
+
+    if overall_failures:
+        logging.error("Encountered %d overall failures.", overall_failures)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
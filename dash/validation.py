@@ -0,0 +1,406 @@
+"""Declarative validation of HATS catalogs, from their parquet statistics.
+
+The rules (validation_rules.yaml) map column patterns to expected value
+ranges, null budgets and orderings. They are evaluated on the statistics
+of every row group, that the parquet footers already hold and that the
+_metadata file of a catalog gathers, so that validating a catalog only
+reads that file. The checks that these statistics cannot answer (columns
+without statistics, or the ordering of the rows within a row group) read
+the data of a sample of the partitions instead.
+"""
+
+import dataclasses
+import fnmatch
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import hats
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import yaml
+from hats.io import file_io, paths
+from hats.io.validation import is_valid_catalog
+
+RULES_FILE = Path(__file__).parent / "validation_rules.yaml"
+# MJD of the Unix epoch, to resolve "today" in the rules
+UNIX_EPOCH_MJD = 40587.0
+MONOTONIC = ("increasing", "decreasing")
+
+
+def resolve_value(value):
+    """Value of a rule bound; "today" is the current MJD."""
+    if value == "today":
+        return time.time() / 86400 + UNIX_EPOCH_MJD
+    return None if value is None else float(value)
+
+
+@dataclasses.dataclass
+class Rule:
+    """Checks of the columns matching any of some patterns (e.g. "*FluxErr"),
+    in all the catalogs or only the given ones."""
+
+    name: str
+    columns: list[str]
+    catalogs: list[str] | None = None
+    min: float | None = None
+    max: float | None = None
+    max_null_fraction: float | None = None
+    monotonic: str | None = None
+
+    def __post_init__(self):
+        if self.monotonic not in (None,) + MONOTONIC:
+            raise ValueError(f"{self.name}: monotonic must be one of {MONOTONIC}")
+        self.min = resolve_value(self.min)
+        self.max = resolve_value(self.max)
+
+    def applies_to(self, catalog_name):
+        return self.catalogs is None or catalog_name in self.catalogs
+
+    def matching_columns(self, columns):
+        return [
+            column
+            for column in columns
+            if any(fnmatch.fnmatchcase(column, pattern) for pattern in self.columns)
+        ]
+
+    def missing_columns(self, columns):
+        """Columns named without wildcards that the catalog does not have.
+        Only rules restricted to some catalogs expect all of their columns."""
+        if self.catalogs is None:
+            return []
+        return [
+            pattern
+            for pattern in self.columns
+            if not any(char in pattern for char in "*?[") and pattern not in columns
+        ]
+
+
+@dataclasses.dataclass
+class RuleSet:
+    """Validation rules, and patterns of the columns that no rule checks."""
+
+    rules: list[Rule]
+    exclude: list[str] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_yaml(cls, path=RULES_FILE):
+        with open(path, encoding="utf8") as rules_file:
+            config = yaml.safe_load(rules_file)
+        return cls(
+            rules=[Rule(**rule) for rule in config["rules"]],
+            exclude=config.get("exclude", []),
+        )
+
+    def checked_columns(self, catalog_name, columns):
+        """Pairs of the rules of a catalog and the columns each one checks."""
+        columns = [
+            column
+            for column in columns
+            if not any(fnmatch.fnmatchcase(column, pattern) for pattern in self.exclude)
+        ]
+        return [
+            (rule, rule.matching_columns(columns))
+            for rule in self.rules
+            if rule.applies_to(catalog_name)
+        ]
+
+
+def read_column_statistics(catalog_dir, ordered_columns=()):
+    """Statistics of every column of a catalog, aggregated over the row groups
+    of its _metadata file.
+
+    Returns a frame indexed by column with the number of rows, of nulls
+    (missing when some row group does not tell), the min and max values and
+    whether they are known (i.e. all row groups with values have them), and
+    the (file, min, max) of every row group of the ordered columns.
+    """
+    metadata = file_io.read_parquet_metadata(
+        paths.get_parquet_metadata_pointer(catalog_dir)
+    )
+    names = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    null_counts = np.zeros(len(names), dtype=np.int64)
+    nulls_known = np.ones(len(names), dtype=bool)
+    min_max_known = np.ones(len(names), dtype=bool)
+    min_values = [None] * len(names)
+    max_values = [None] * len(names)
+    row_groups = {name: [] for name in ordered_columns if name in names}
+    ordered = {names.index(name): name for name in row_groups}
+
+    for rg_index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg_index)
+        for index in range(len(names)):
+            column = row_group.column(index)
+            stats = column.statistics
+            if stats is None or not stats.has_null_count:
+                nulls_known[index] = False
+            else:
+                null_counts[index] += stats.null_count
+            if stats is not None and stats.has_min_max:
+                low, high = stats.min, stats.max
+                if min_values[index] is None or low < min_values[index]:
+                    min_values[index] = low
+                if max_values[index] is None or high > max_values[index]:
+                    max_values[index] = high
+            elif stats is None or stats.null_count != row_group.num_rows:
+                # A row group of nulls only has no min/max, others should
+                low = high = None
+                min_max_known[index] = False
+            else:
+                low = high = None
+            if index in ordered:
+                row_groups[ordered[index]].append((column.file_path, low, high))
+
+    columns = pd.DataFrame(
+        {
+            "num_rows": metadata.num_rows,
+            "null_count": pd.array(
+                np.where(nulls_known, null_counts, 0), dtype="Int64"
+            ),
+            "min_value": min_values,
+            "max_value": max_values,
+            "min_max_known": min_max_known,
+        },
+        index=pd.Index(names, name="column"),
+    )
+    columns.loc[~nulls_known, "null_count"] = pd.NA
+    return columns, row_groups
+
+
+def row_group_order_violation(row_groups, monotonic):
+    """File whose consecutive row groups overlap or are out of order, if any."""
+    previous_file, previous_bound = None, None
+    for file_path, low, high in row_groups:
+        if low is None:
+            continue
+        if file_path == previous_file:
+            if (monotonic == "increasing" and low < previous_bound) or (
+                monotonic == "decreasing" and high > previous_bound
+            ):
+                return file_path
+        previous_file = file_path
+        previous_bound = high if monotonic == "increasing" else low
+    return None
+
+
+def is_monotonic(values, monotonic):
+    values = np.asarray(values)
+    steps = np.diff(values)
+    return bool(np.all(steps >= 0) if monotonic == "increasing" else np.all(steps <= 0))
+
+
+def check_record(catalog_name, rule, column, check, passed, detail, source="footer"):
+    return {
+        "catalog": catalog_name,
+        "rule": rule.name,
+        "column": column,
+        "check": check,
+        "status": "ok" if passed else "failed",
+        "source": source,
+        "detail": detail,
+    }
+
+
+def in_range(rule, low, high):
+    """Whether values between low and high (None if all null) are within the
+    bounds of the rule."""
+    return low is None or (
+        (rule.min is None or float(low) >= rule.min)
+        and (rule.max is None or float(high) <= rule.max)
+    )
+
+
+@dataclasses.dataclass
+class CatalogValidation:
+    """Outcome of the validation of a catalog."""
+
+    name: str
+    is_valid: bool
+    num_partitions: int
+    num_rows: int
+    columns: pd.DataFrame
+    checks: pd.DataFrame
+
+    @property
+    def failures(self):
+        return self.checks[self.checks["status"] == "failed"]
+
+    def report(self):
+        print(self.name)
+        print("  is valid catalog", self.is_valid)
+        print("  num partitions:", self.num_partitions)
+        print("  num rows:", self.num_rows)
+        print("  num columns:", len(self.columns))
+        for rule, checks in self.checks.groupby("rule", sort=False):
+            failed = checks[checks["status"] == "failed"]
+            for _, check in failed.iterrows():
+                print(f"**** {check['column']} failed {rule}: {check['detail']}")
+            if failed.empty:
+                sampled = checks.loc[checks["source"] != "footer", "column"].nunique()
+                print(
+                    f"  All {checks['column'].nunique()} columns pass {rule}"
+                    + (f" ({sampled} from sampled data)" if sampled else "")
+                )
+        with_nulls = self.columns[self.columns["null_count"].fillna(0) > 0]
+        print(f"  columns with nulls: {len(with_nulls)}")
+        if len(with_nulls):
+            with_nulls = with_nulls[["null_count"]].assign(
+                percent=with_nulls["null_count"] / self.num_rows * 100
+            )
+            print(with_nulls.sort_values(by="percent", ascending=False))
+
+
+def validate_catalog(catalog_dir, rule_set, sample_size=10):
+    """Evaluate the rules of a catalog on its footer statistics, reading the
+    data of up to sample_size partitions for the checks these cannot answer."""
+    catalog_dir = Path(catalog_dir)
+    catalog = hats.read_hats(catalog_dir)
+    name = catalog.catalog_name
+    checked = rule_set.checked_columns(name, catalog.schema.names)
+    ordered_columns = {
+        column for rule, columns in checked if rule.monotonic for column in columns
+    }
+    columns, row_groups = read_column_statistics(catalog_dir, ordered_columns)
+
+    checks = []
+    # Checks the statistics cannot answer, evaluated on sampled data
+    pending = []
+
+    def add_check(rule, column, check, passed, detail):
+        checks.append(check_record(name, rule, column, check, passed, detail))
+
+    for rule, rule_columns in checked:
+        for column in rule.missing_columns(catalog.schema.names):
+            add_check(rule, column, "exists", False, "column is missing")
+        for column in rule_columns:
+            stats = columns.loc[column]
+            if rule.min is not None or rule.max is not None:
+                if not stats["min_max_known"]:
+                    pending.append((rule, column, "range"))
+                else:
+                    low, high = stats["min_value"], stats["max_value"]
+                    add_check(
+                        rule,
+                        column,
+                        "range",
+                        in_range(rule, low, high),
+                        f"min: {low}, max: {high}",
+                    )
+            if rule.max_null_fraction is not None:
+                if pd.isna(stats["null_count"]):
+                    pending.append((rule, column, "nulls"))
+                else:
+                    fraction = stats["null_count"] / max(stats["num_rows"], 1)
+                    add_check(
+                        rule,
+                        column,
+                        "nulls",
+                        fraction <= rule.max_null_fraction,
+                        f"null fraction: {fraction:.3g}",
+                    )
+            if rule.monotonic:
+                violation = row_group_order_violation(
+                    row_groups[column], rule.monotonic
+                )
+                if violation is not None:
+                    add_check(
+                        rule,
+                        column,
+                        "monotonic",
+                        False,
+                        f"row groups of {violation} are not {rule.monotonic}",
+                    )
+                elif all(low == high for _, low, high in row_groups[column]):
+                    add_check(rule, column, "monotonic", True, "")
+                else:
+                    # Row groups are in order, but rows within them may not be
+                    pending.append((rule, column, "monotonic"))
+
+    if pending:
+        checks += check_sampled_partitions(catalog_dir, name, pending, sample_size)
+        rule_order = {rule.name: index for index, (rule, _) in enumerate(checked)}
+        checks.sort(key=lambda check: rule_order[check["rule"]])
+
+    return CatalogValidation(
+        name=name,
+        is_valid=is_valid_catalog(catalog_dir, strict=True, verbose=False),
+        num_partitions=len(catalog.get_healpix_pixels()),
+        num_rows=catalog.catalog_info.total_rows,
+        columns=columns,
+        checks=pd.DataFrame(
+            checks,
+            columns=[
+                "catalog",
+                "rule",
+                "column",
+                "check",
+                "status",
+                "source",
+                "detail",
+            ],
+        ),
+    )
+
+
+def check_sampled_partitions(catalog_dir, name, pending, sample_size):
+    """Evaluate checks on the data of a sample of the partitions, evenly spread
+    over the catalog, reading only the columns of these checks."""
+    pixels = hats.read_hats(catalog_dir).get_healpix_pixels()
+    sample = [
+        pixels[index]
+        for index in np.unique(
+            np.linspace(0, len(pixels) - 1, min(sample_size, len(pixels))).astype(int)
+        )
+    ]
+    read_columns = sorted({column for _, column, _ in pending})
+    partitions = []
+    for pixel in sample:
+        partition_file = paths.pixel_catalog_file(catalog_dir, pixel)
+        partitions.append(
+            pq.read_table(
+                partition_file.path, filesystem=partition_file.fs, columns=read_columns
+            )
+        )
+    source = f"sample of {len(sample)}/{len(pixels)} partitions"
+
+    checks = []
+    for rule, column, check in pending:
+        arrays = [partition[column] for partition in partitions]
+        if check == "range":
+            lows = [pc.min(array).as_py() for array in arrays]
+            highs = [pc.max(array).as_py() for array in arrays]
+            low = min((value for value in lows if value is not None), default=None)
+            high = max((value for value in highs if value is not None), default=None)
+            passed = in_range(rule, low, high)
+            detail = f"min: {low}, max: {high}"
+        elif check == "nulls":
+            num_rows = sum(len(array) for array in arrays)
+            fraction = sum(array.null_count for array in arrays) / max(num_rows, 1)
+            passed = fraction <= rule.max_null_fraction
+            detail = f"null fraction: {fraction:.3g}"
+        else:
+            passed = all(
+                array.null_count == 0 and is_monotonic(array.to_numpy(), rule.monotonic)
+                for array in arrays
+            )
+            detail = "" if passed else f"rows are not {rule.monotonic}"
+        checks.append(check_record(name, rule, column, check, passed, detail, source))
+    return checks
+
+
+def validate_catalogs(hats_dir, catalog_names, rule_set=None, sample_size=10):
+    """Validate catalogs of a directory in parallel, one process per catalog.
+
+    Returns the CatalogValidation of every catalog, by name.
+    """
+    rule_set = rule_set or RuleSet.from_yaml()
+    with ProcessPoolExecutor(max_workers=len(catalog_names)) as executor:
+        results = executor.map(
+            validate_catalog,
+            [Path(hats_dir) / name for name in catalog_names],
+            [rule_set] * len(catalog_names),
+            [sample_size] * len(catalog_names),
+        )
+        return dict(zip(catalog_names, results))
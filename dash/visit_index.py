@@ -0,0 +1,114 @@
+"""Vectorized lookups of visit metadata by visit id.
+
+The visit table is converted once into one ``.npy`` file per column, with
+the rows sorted by visit id. Every process memory-maps these files, so they
+are shared through the page cache instead of being copied into each Dask
+task, and a lookup is a single ``searchsorted`` over the visit ids.
+"""
+
+import functools
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+VISIT_ID_COLUMN = "visitId"
+VISIT_COLUMNS = ["expMidptMJD", "band", "expTime", "airmass"]
+
+
+class VisitIndex:
+    """Visit metadata columns as NumPy arrays sorted by visit id.
+
+    An index loaded from a directory pickles as just its path, and is
+    memory-mapped again (once per process) when unpickled.
+    """
+
+    def __init__(self, visit_ids, columns, directory=None):
+        self.visit_ids = visit_ids
+        self.columns = columns
+        self.directory = directory
+
+    @classmethod
+    def from_parquet(cls, path, columns=None):
+        """Build an index from the visit table, keeping the given columns (by
+        default, those of VISIT_COLUMNS that the table has)."""
+        if columns is None:
+            names = pq.read_schema(path).names
+            columns = [column for column in VISIT_COLUMNS if column in names]
+        table = pq.read_table(path, columns=[VISIT_ID_COLUMN] + list(columns))
+        if len(table) == 0:
+            raise ValueError(f"{path} has no visits")
+        table = table.sort_by(VISIT_ID_COLUMN)
+        visit_ids = table[VISIT_ID_COLUMN].to_numpy()
+        if np.any(visit_ids[1:] == visit_ids[:-1]):
+            raise ValueError(f"{path} has duplicate visit ids")
+        arrays = {}
+        for column in columns:
+            values = table[column]
+            if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+                # Fixed-width strings, so that they can be memory-mapped
+                arrays[column] = np.array(values.fill_null("").to_pylist(), dtype=str)
+            else:
+                arrays[column] = values.to_numpy()
+        return cls(visit_ids, arrays)
+
+    def save(self, directory):
+        """Write the index as .npy files and return it memory-mapped from there."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / f"{VISIT_ID_COLUMN}.npy", self.visit_ids)
+        for column, values in self.columns.items():
+            np.save(directory / f"{column}.npy", values)
+        return VisitIndex.load(directory)
+
+    @classmethod
+    def load(cls, directory):
+        directory = Path(directory)
+        visit_ids = np.load(directory / f"{VISIT_ID_COLUMN}.npy", mmap_mode="r")
+        columns = {
+            path.stem: np.load(path, mmap_mode="r")
+            for path in sorted(directory.glob("*.npy"))
+            if path.stem != VISIT_ID_COLUMN
+        }
+        return cls(visit_ids, columns, directory=str(directory))
+
+    def __reduce__(self):
+        if self.directory is None:
+            return (VisitIndex, (self.visit_ids, self.columns))
+        return (load_visit_index, (self.directory,))
+
+    def __len__(self):
+        return len(self.visit_ids)
+
+    def positions(self, visits):
+        """Row of every visit in the index, and whether it was found at all."""
+        if isinstance(visits, (pa.Array, pa.ChunkedArray)):
+            visits = visits.to_numpy(zero_copy_only=False)
+        visits = np.asarray(visits)
+        positions = np.searchsorted(self.visit_ids, visits)
+        np.minimum(positions, len(self.visit_ids) - 1, out=positions)
+        found = self.visit_ids[positions] == visits
+        return positions, found
+
+    def lookup(self, visits, columns=None):
+        """Metadata of the given visits, as a table with a row per visit.
+
+        Visits missing from the index get nulls. ``columns`` defaults to all
+        the columns of the index.
+        """
+        columns = list(self.columns) if columns is None else columns
+        positions, found = self.positions(visits)
+        missing = None if found.all() else ~found
+        return pa.table(
+            {
+                column: pa.array(self.columns[column][positions], mask=missing)
+                for column in columns
+            }
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def load_visit_index(directory) -> VisitIndex:
+    """Memory-map the index saved in a directory, once per process."""
+    return VisitIndex.load(directory)
@@ -1,21 +1,46 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from io import BytesIO
 from contextlib import contextmanager
+from pathlib import Path
 
 import astropy.units as u
+import hats
 import lsst.geom as geom
-import matplotlib.pyplot as plt
+import nested_pandas as npd
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
 import plotly.express as px
 from astropy.coordinates import SkyCoord
 from astropy.visualization import ZScaleInterval
 from astropy.visualization.wcsaxes import SphericalCircle
 from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+from hats.catalog import TableProperties
+from hats.catalog.dataset.collection_properties import CollectionProperties
+from hats.io import paths
+from hats.pixel_math import HealpixPixel
+from hats.pixel_math.spatial_index import SPATIAL_INDEX_COLUMN
 from ipywidgets import Layout, Output, VBox, HBox
 from IPython.display import display
-from lsdb import read_hats
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+from nested_pandas.nestedframe.io import from_pyarrow
 from PIL import Image
 from reproject import reproject_interp
 
@@ -23,6 +48,39 @@ from reproject import reproject_interp
 BAND_COLORS = {'u': '#0c71ff', 'g': '#49be61', 'r': '#c61c00',
                'i': '#ffc200', 'z': '#f341a2', 'y': '#5d0000'}
 
+# Collection, indexed id column, light curve column and the columns make_figure
+# needs, by lc_object_type
+OBJECT_TYPES = {
+    "object": dict(
+        collection="object_collection",
+        id_column="objectId",
+        lc_column="objectForcedSource",
+        figure_columns=("objectId", "coord_ra", "coord_dec"),
+    ),
+    "dia_object": dict(
+        collection="dia_object_collection",
+        id_column="diaObjectId",
+        lc_column="diaObjectForcedSource",
+        figure_columns=("diaObjectId", "ra", "dec"),
+    ),
+}
+
+LC_QUALITY_QUERY = (
+    "~lc.psfFlux_flag"
+    " and ~lc.pixelFlags_suspect"
+    " and ~lc.pixelFlags_saturated"
+    " and ~lc.pixelFlags_cr"
+    " and ~lc.pixelFlags_bad"
+)
+
+# Light curves loaded by id are kept on local disk, shared by the notebook
+# sessions of a user
+LC_CACHE_DIR = Path(
+    os.environ.get("SINGLE_OBJECT_CACHE_DIR", Path.home() / ".cache" / "single_object")
+)
+LC_CACHE_MAX_BYTES = 2 * 1024**3
+LC_CACHE_MAX_AGE_DAYS = 30
+
 
 @contextmanager
 def show_all_rows():
@@ -45,32 +103,174 @@ def create_wcs(ra, dec, size=100, pixel_scale=0.2):
     return w
 
 
-def get_cutout(butler, data_id, ra, dec, size=100, image_type="direct"):
+def image_collection(image_type):
     if image_type.lower() == "direct":
-        collection = "visit_image"
+        return "visit_image"
     elif image_type.lower() == "dia":
-        collection = "difference_image"
-    else:
-        raise ValueError(f"Unknown image type: {image_type}")
+        return "difference_image"
+    raise ValueError(f"Unknown image type: {image_type}")
 
-    wcs = butler.get(f'{collection}.wcs', **data_id)
-    detector_box = butler.get(f'{collection}.detector', **data_id).getBBox()
-    xy = geom.PointI(wcs.skyToPixel(geom.SpherePoint(ra, dec, geom.degrees)))
 
+def stamp_box(wcs, detector_box, ra, dec, size):
+    xy = geom.PointI(wcs.skyToPixel(geom.SpherePoint(ra, dec, geom.degrees)))
     cutout_size = geom.ExtentI(size, size)
     cutout_box = geom.BoxI(xy - cutout_size // 2, cutout_size)
-    cutout_box = cutout_box.clippedTo(detector_box)
+    return cutout_box.clippedTo(detector_box)
+
 
+def get_cutout(butler, data_id, ra, dec, size=100, image_type="direct"):
+    collection = image_collection(image_type)
+    wcs = butler.get(f'{collection}.wcs', **data_id)
+    detector_box = butler.get(f'{collection}.detector', **data_id).getBBox()
+    cutout_box = stamp_box(wcs, detector_box, ra, dec, size)
     return butler.get(collection, **data_id, parameters={'bbox': cutout_box}), cutout_box
 
 
-def plot_cutout(butler, visit_id, detector_id, ra, dec, size=100, reproject_wcs=None, image_type="direct"):
-    data_id = dict(visit=visit_id, detector=detector_id, instrument="LSSTComCam")
-    
-    cutout, cutout_box = get_cutout(butler, data_id, ra, dec, size=size, image_type=image_type)
+class CutoutService:
+    """Cutouts of the images of a butler, for the single object viewer.
+
+    The WCS and detector bounding box of every image are read once, so that a
+    cutout is a single butler.get of its pixels. Rendered cutouts are kept by
+    epoch, compressed, and prefetch renders those of a whole light curve in a
+    thread pool, ahead of the clicks on it. Every thread reads through its own
+    clone of the butler, as butler instances are not meant to be shared
+    between threads.
+    """
+
+    def __init__(self, butler, instrument="LSSTComCam", max_workers=8, max_images=512):
+        # Weak: the shared services are kept by butler, weakly
+        self._butler = weakref.ref(butler)
+        self._local = threading.local()
+        self.instrument = instrument
+        self.max_workers = max_workers
+        self.max_images = max_images
+        self._geometries = {}
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def butler(self):
+        return self._butler()
+
+    @property
+    def thread_butler(self):
+        """The clone of the butler of the calling thread."""
+        butler = getattr(self._local, "butler", None)
+        if butler is None:
+            butler = self._local.butler = self.butler.clone()
+        return butler
+
+    def data_id(self, visit_id, detector_id):
+        return dict(visit=visit_id, detector=detector_id, instrument=self.instrument)
+
+    def geometry(self, collection, data_id):
+        """WCS and detector bounding box of an image."""
+        key = (collection, data_id["visit"], data_id["detector"])
+        with self._lock:
+            if key in self._geometries:
+                return self._geometries[key]
+        wcs = self.thread_butler.get(f'{collection}.wcs', **data_id)
+        detector_box = self.thread_butler.get(f'{collection}.detector', **data_id).getBBox()
+        with self._lock:
+            return self._geometries.setdefault(key, (wcs, detector_box))
+
+    def get_cutout(self, data_id, ra, dec, size=100, image_type="direct"):
+        collection = image_collection(image_type)
+        wcs, detector_box = self.geometry(collection, data_id)
+        cutout_box = stamp_box(wcs, detector_box, ra, dec, size)
+        cutout = self.thread_butler.get(collection, **data_id, parameters={'bbox': cutout_box})
+        return cutout, cutout_box
+
+    def stamp_array(self, cutout, cutout_box, data_id, ra, dec, size, image_type):
+        """Pixels of a smaller stamp around the same position, sliced from a
+        cutout rather than read again."""
+        wcs, detector_box = self.geometry(image_collection(image_type), data_id)
+        box = stamp_box(wcs, detector_box, ra, dec, size)
+        x0 = box.getMinX() - cutout_box.getMinX()
+        y0 = box.getMinY() - cutout_box.getMinY()
+        return cutout.getImage().getArray()[y0:y0 + box.getHeight(), x0:x0 + box.getWidth()]
+
+    def _image_key(self, visit_id, detector_id, ra, dec, size, image_type, render):
+        # The reprojection WCS is created from the position and size
+        return (int(visit_id), int(detector_id), ra, dec, size, image_type, render)
+
+    def submit(self, visit_id, detector_id, ra, dec, size=100, reproject_wcs=None, image_type="direct", render="array"):
+        """Future of the RenderedCutout of an epoch, rendered once."""
+        key = self._image_key(visit_id, detector_id, ra, dec, size, image_type, render)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            future = self._executor.submit(
+                render_cutout,
+                self.butler,
+                visit_id,
+                detector_id,
+                ra,
+                dec,
+                size=size,
+                reproject_wcs=reproject_wcs,
+                image_type=image_type,
+                cutouts=self,
+                render=render,
+            )
+            self._images[key] = future
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+        return future
+
+    def image(self, visit_id, detector_id, ra, dec, size=100, reproject_wcs=None, image_type="direct", render="array"):
+        return self.submit(visit_id, detector_id, ra, dec, size, reproject_wcs, image_type, render).result()
+
+    def prefetch(self, lc, ra, dec, size=100, reproject_wcs=None, image_type="direct", render="array"):
+        """Start rendering the cutouts of all the epochs of a light curve, in
+        order, and return their futures."""
+        return [
+            self.submit(row.visit, row.detector, ra, dec, size, reproject_wcs, image_type, render)
+            for row in lc.itertuples()
+        ]
+
+    def render_all(self, lc, ra, dec, size=100, reproject_wcs=None, image_type="direct", render="array"):
+        """RenderedCutouts of all the epochs of a light curve, in order."""
+        futures = self.prefetch(lc, ra, dec, size, reproject_wcs, image_type, render)
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_CUTOUT_SERVICES = weakref.WeakKeyDictionary()
+
+
+def cutout_service(butler):
+    """The cutout service of a butler, shared by the figures of a session
+    while the butler is in use."""
+    if butler not in _CUTOUT_SERVICES:
+        _CUTOUT_SERVICES[butler] = CutoutService(butler)
+    return _CUTOUT_SERVICES[butler]
+
+
+def cutout_title(visit_id, detector_id, ra, dec, ap10_flux):
+    return f"visit: {visit_id}, detector: {detector_id}, {ra=:.5f}, {dec=:.5f}\n{ap10_flux=:.0f}"
+
+
+def prepare_cutout(butler, visit_id, detector_id, ra, dec, size=100, reproject_wcs=None, image_type="direct", cutouts=None):
+    """Pixels of a cutout (reprojected if a WCS is given) and their astropy WCS,
+    with the limits and colormap to show them with and the flux in a 10 px
+    aperture."""
+    if cutouts is None:
+        cutouts = cutout_service(butler)
+    data_id = cutouts.data_id(visit_id, detector_id)
+
+    cutout, cutout_box = cutouts.get_cutout(data_id, ra, dec, size=size, image_type=image_type)
     cutout_box_min_corner = cutout_box.getCorners()[0]
 
-    cutout10_array = get_cutout(butler, data_id, ra, dec, size=10, image_type=image_type)[0].getImage().getArray()
+    cutout10_array = cutouts.stamp_array(cutout, cutout_box, data_id, ra, dec, size=10, image_type=image_type)
     ap10_flux = cutout10_array.sum()
 
     try:
@@ -109,92 +309,368 @@ def plot_cutout(butler, visit_id, detector_id, ra, dec, size=100, reproject_wcs=
         cmap = "managua"
     else:
         raise ValueError(f"Unknown image type: {image_type}")
+    return image_array, astropy_wcs, vmin, vmax, cmap, ap10_flux
 
-    plt.figure(figsize=(8, 8), dpi=200)
-    plt.subplot(projection=astropy_wcs)
-    plt.title(f"visit: {visit_id}, detector: {detector_id}, {ra=:.5f}, {dec=:.5f}\n{ap10_flux=:.0f}")
-    lon = plt.gca().coords[0]
-    lat = plt.gca().coords[1]
+
+def plot_cutout(butler, visit_id, detector_id, ra, dec, size=100, reproject_wcs=None, image_type="direct", cutouts=None):
+    image_array, astropy_wcs, vmin, vmax, cmap, ap10_flux = prepare_cutout(
+        butler, visit_id, detector_id, ra, dec, size, reproject_wcs, image_type, cutouts
+    )
+
+    # Not pyplot, which is not thread-safe: cutouts are rendered in a thread pool
+    fig = Figure(figsize=(8, 8), dpi=200)
+    ax = fig.add_subplot(projection=astropy_wcs)
+    ax.set_title(cutout_title(visit_id, detector_id, ra, dec, ap10_flux))
+    lon = ax.coords[0]
+    lat = ax.coords[1]
     lon.set_major_formatter('dd:mm:ss')
     lat.set_major_formatter('dd:mm:ss')
     lon.set_ticklabel(exclude_overlapping=False)
     lat.set_ticklabel(exclude_overlapping=False)
     lon.set_ticklabel_position('b')
     lat.set_ticklabel_position('l')
-    plt.imshow(image_array, cmap=cmap, vmin=vmin, vmax=vmax, origin='lower')
-    plt.xlabel('RA')
-    plt.ylabel('Dec')
+    im = ax.imshow(image_array, cmap=cmap, vmin=vmin, vmax=vmax, origin='lower')
+    ax.set_xlabel('RA')
+    ax.set_ylabel('Dec')
     # circle patch for source position
     circle = SphericalCircle(SkyCoord(ra, dec, unit=u.deg), 1*u.arcsec, edgecolor='red', facecolor='none', 
-                             transform=plt.gca().get_transform('icrs'))
-    plt.gca().add_patch(circle)
+                             transform=ax.get_transform('icrs'))
+    ax.add_patch(circle)
     lon.set_ticks(spacing=3. * u.arcsec)
     lat.set_ticks(spacing=3. * u.arcsec)
-    plt.grid(color='white', alpha=0.5, ls='solid')
-    plt.colorbar()
+    ax.grid(color='white', alpha=0.5, ls='solid')
+    fig.colorbar(im)
 
     buf = BytesIO()
-    plt.savefig(buf, format='png', pad_inches=0)
-    plt.close()
+    fig.savefig(buf, format='png', pad_inches=0)
 
     buf.seek(0)
     image = Image.open(buf)
     return np.asarray(image)
 
 
-@lru_cache(maxsize=1024)
-def load_object_and_forced(oid, hats_path, filter=True):
-    filters = [("objectId", "==", oid)]
-
-    # comcam_obj = hats_path / "object"
-    # comcam_src = hats_path / "object_forced_source"
-    path = hats_path / "object_collection"
-
-    catalog = read_hats(
-        path,
-        # columns=["objectId", "coord_ra", "coord_dec"],
-        filters=filters,
-    ).map_partitions(
-        lambda df: df.rename(columns={"objectForcedSource": "lc"})
-    )
-
-    ndf = catalog.compute()
-    if filter:
-        ndf = ndf.query(
-            "~lc.psfFlux_flag"
-            " and ~lc.pixelFlags_suspect"
-            " and ~lc.pixelFlags_saturated"
-            " and ~lc.pixelFlags_cr"
-            " and ~lc.pixelFlags_bad"
+@lru_cache
+def colormap_lut(cmap):
+    """uint8 RGB of the 256 levels of a matplotlib colormap."""
+    return np.round(colormaps[cmap](np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+
+
+def colorize(image_array, vmin, vmax, cmap):
+    """uint8 RGB of an image (or a stack of them), mapped linearly from vmin to
+    vmax onto the levels of a colormap as imshow does, and flipped to row 0 at
+    the top, as go.Image shows it."""
+    scaled = (np.asarray(image_array, dtype=np.float64) - vmin) / max(vmax - vmin, np.finfo(np.float64).tiny)
+    levels = np.clip(np.nan_to_num(scaled * 256, nan=0.0), 0, 255).astype(np.uint8)
+    rgb = colormap_lut(cmap)[levels]
+    # Blank (off the image after reprojection) shows white, as in matplotlib
+    rgb[np.isnan(scaled)] = 255
+    return rgb[..., ::-1, :, :]
+
+
+def svg_path(x, y):
+    return "M " + " L ".join(f"{xi:.2f},{yi:.2f}" for xi, yi in zip(x, y))
+
+
+def cutout_shapes(wcs, ra, dec, shape, radius_arcsec=1.0, grid_spacing_arcsec=3.0, samples=16):
+    """Plotly shapes of the WCS overlays of a colorized cutout of the given
+    shape: a circle around the source position and an RA/Dec grid."""
+    height, width = shape[:2]
+
+    def to_plot(x, y):
+        # Row 0 at the top, as in the colorized array
+        return np.asarray(x), height - 1 - np.asarray(y)
+
+    x, y = map(float, to_plot(*wcs.world_to_pixel_values(ra, dec)))
+    radius = float(radius_arcsec / 3600 / proj_plane_pixel_scales(wcs).mean())
+    shapes = [
+        dict(
+            type="circle",
+            xref="x",
+            yref="y",
+            x0=x - radius,
+            x1=x + radius,
+            y0=y - radius,
+            y1=y + radius,
+            line=dict(color="red", width=2),
         )
-    return ndf.iloc[0]
+    ]
+
+    # Grid lines at multiples of the spacing over the extent of the cutout,
+    # with RA as offsets from the source so that it does not wrap
+    edge_x = np.r_[np.linspace(-0.5, width - 0.5, samples), np.full(samples, width - 0.5),
+                   np.linspace(-0.5, width - 0.5, samples), np.full(samples, -0.5)]
+    edge_y = np.r_[np.full(samples, -0.5), np.linspace(-0.5, height - 0.5, samples),
+                   np.full(samples, height - 0.5), np.linspace(-0.5, height - 0.5, samples)]
+    edge_ra, edge_dec = wcs.pixel_to_world_values(edge_x, edge_y)
+    edge_dra = (edge_ra - ra + 180) % 360 - 180
+    step = grid_spacing_arcsec / 3600
+    line = dict(color="rgba(255, 255, 255, 0.5)", width=1)
+    dec_samples = np.linspace(edge_dec.min(), edge_dec.max(), samples)
+    for dra in np.arange(np.ceil((ra + edge_dra.min()) / step), np.floor((ra + edge_dra.max()) / step) + 1) * step - ra:
+        line_x, line_y = to_plot(*wcs.world_to_pixel_values(np.full(samples, ra + dra), dec_samples))
+        shapes.append(dict(type="path", xref="x", yref="y", path=svg_path(line_x, line_y), line=line))
+    ra_samples = ra + np.linspace(edge_dra.min(), edge_dra.max(), samples)
+    for line_dec in np.arange(np.ceil(edge_dec.min() / step), np.floor(edge_dec.max() / step) + 1) * step:
+        line_x, line_y = to_plot(*wcs.world_to_pixel_values(ra_samples, np.full(samples, line_dec)))
+        shapes.append(dict(type="path", xref="x", yref="y", path=svg_path(line_x, line_y), line=line))
+    return shapes
+
+
+@dataclasses.dataclass
+class RenderedCutout:
+    """A rendered cutout, as a zlib-compressed uint8 RGB array, with the title
+    and plotly shapes to show it with (none when they are drawn in it)."""
+
+    data: bytes
+    shape: tuple
+    title: str = None
+    shapes: list = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_array(cls, image, title=None, shapes=None):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        return cls(zlib.compress(image.tobytes(), 1), image.shape, title, shapes or [])
+
+    @property
+    def array(self):
+        return np.frombuffer(zlib.decompress(self.data), dtype=np.uint8).reshape(self.shape)
+
+
+def render_cutout(butler, visit_id, detector_id, ra, dec, size=100, reproject_wcs=None, image_type="direct", cutouts=None, render="array"):
+    """Render a cutout, either as its colorized pixels with plotly overlays
+    ("array"), or as a matplotlib figure with WCS axes ("matplotlib", slower)."""
+    if render == "matplotlib":
+        return RenderedCutout.from_array(
+            plot_cutout(butler, visit_id, detector_id, ra, dec, size, reproject_wcs, image_type, cutouts)
+        )
+    elif render != "array":
+        raise ValueError(f"Unknown render mode: {render}")
+    image_array, astropy_wcs, vmin, vmax, cmap, ap10_flux = prepare_cutout(
+        butler, visit_id, detector_id, ra, dec, size, reproject_wcs, image_type, cutouts
+    )
+    return RenderedCutout.from_array(
+        colorize(image_array, vmin, vmax, cmap),
+        title=cutout_title(visit_id, detector_id, ra, dec, ap10_flux).replace("\n", "<br>"),
+        shapes=cutout_shapes(astropy_wcs, ra, dec, image_array.shape),
+    )
 
 
-@lru_cache(maxsize=1024)
-def load_dia_object_and_forced(oid, hats_path, filter=True):
-    filters = [("diaObjectId", "==", oid)]
+class LightCurveCache:
+    """Objects and their light curves, as loaded by load_many, in parquet files
+    on local disk.
+
+    An entry is keyed by collection, version, id, quality filter and columns.
+    The version of a collection is the creation date of its main catalog:
+    the entries of a collection are all removed when it is regenerated. The
+    modification time of an entry is its last use, and entries are evicted
+    when unused for max_age_days, or least recently used first when the
+    cache grows over max_bytes.
+
+    The cache is only scanned to evict entries when a running estimate of
+    its size goes over max_bytes, or every evict_interval seconds (for the
+    entries written by other sessions, and those grown old).
+    """
+
+    VERSION_FILE = "hats_creation_date"
+
+    def __init__(
+        self,
+        cache_dir=LC_CACHE_DIR,
+        max_bytes=LC_CACHE_MAX_BYTES,
+        max_age_days=LC_CACHE_MAX_AGE_DAYS,
+        evict_interval=3600,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.evict_interval = evict_interval
+        # Unknown until the first scan
+        self._size = None
+        self._next_evict = 0
+
+    def collection_dir(self, collection_path, version):
+        # Not resolved: the collection may be remote
+        collection_path = str(collection_path)
+        key = hashlib.sha1(collection_path.encode()).hexdigest()[:16]
+        collection_dir = self.cache_dir / key
+        version_file = collection_dir / self.VERSION_FILE
+        if collection_dir.exists() and (
+            not version_file.exists() or version_file.read_text() != version
+        ):
+            # Regenerated since cached
+            shutil.rmtree(collection_dir, ignore_errors=True)
+        if not version_file.exists():
+            collection_dir.mkdir(parents=True, exist_ok=True)
+            (collection_dir / "path").write_text(collection_path)
+            version_file.write_text(version)
+        return collection_dir
+
+    def entry_path(self, collection_dir, oid, filter, columns):
+        key = hashlib.sha1(json.dumps([bool(filter), columns]).encode()).hexdigest()
+        return collection_dir / f"{oid}-{key[:12]}.parquet"
+
+    def get(self, collection_dir, ids, filter, columns):
+        """The cached entries of the ids, and the ids which are not cached."""
+        tables, missing = [], []
+        now = time.time()
+        for oid in ids:
+            path = self.entry_path(collection_dir, oid, filter, columns)
+            try:
+                tables.append(pq.read_table(path))
+                # Mark as recently used
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                missing.append(oid)
+        if not tables:
+            return [], missing
+        # Converted to a nested frame once, rather than entry by entry
+        return [from_pyarrow(pa.concat_tables(tables))], missing
+
+    def put(self, collection_dir, ndf, id_column, filter, columns):
+        for i in range(len(ndf)):
+            row = ndf.iloc[[i]].reset_index(drop=True)
+            path = self.entry_path(collection_dir, row[id_column].iloc[0], filter, columns)
+            # Atomic, as other sessions may read it
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+            row.to_parquet(tmp_path, compression="zstd")
+            os.replace(tmp_path, path)
+            if self._size is not None:
+                self._size += path.stat().st_size
+        if (
+            self._size is None
+            or self._size > self.max_bytes
+            or time.time() >= self._next_evict
+        ):
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*/*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted by another session
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        oldest = time.time() - self.max_age_days * 86400
+        for mtime, size, path in sorted(entries):
+            if mtime >= oldest and total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._size = total
+        self._next_evict = time.time() + self.evict_interval
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+LC_CACHE = LightCurveCache()
+
+
+def catalog_version(collection_path):
+    """Creation date of the main catalog of a collection (read every time, as
+    the collection may be regenerated during a session)."""
+    collection_properties = CollectionProperties.read_from_dir(collection_path)
+    properties = TableProperties.read_from_dir(
+        collection_path / collection_properties.hats_primary_table_url
+    )
+    return properties.extra_dict().get("hats_creation_date", "")
+
+
+@lru_cache(maxsize=16)
+def open_collection(path, id_column, version):
+    """Main catalog of a collection and the index catalog of one of its columns,
+    read once per version of the collection."""
+    collection = hats.read_hats(path)
+    index_catalog = hats.read_hats(collection.get_index_dir_for_field(id_column))
+    return collection.main_catalog, index_catalog
+
+
+def locate_ids(index_catalog, ids):
+    """The ids found in the index catalog, grouped by the pixel of the
+    partition holding them."""
+    column = index_catalog.catalog_info.indexing_column
+    metadata_file = paths.get_parquet_metadata_pointer(index_catalog.catalog_base_dir)
+    dataset = pds.parquet_dataset(metadata_file, filesystem=metadata_file.fs)
+    # The index is sorted by id, so its row group statistics skip most of it
+    found = (
+        dataset.filter(pc.field(column).isin(ids))
+        .to_table(columns=[column, "Norder", "Npix"])
+        .to_pandas(ignore_metadata=True)
+    )
+    return {
+        HealpixPixel(int(order), int(pixel)): group[column].tolist()
+        for (order, pixel), group in found.groupby(["Norder", "Npix"])
+    }
 
-    # comcam_obj = hats_path / "object"
-    # comcam_src = hats_path / "object_forced_source"
-    path = hats_path / "dia_object_collection"
 
-    catalog = read_hats(
-        path,
-        # columns=["objectId", "coord_ra", "coord_dec"],
-        filters=filters,
-    ).map_partitions(
-        lambda df: df.rename(columns={"diaObjectForcedSource": "lc"})
+def read_partition_rows(catalog, pixel, id_column, ids, columns=None):
+    """Rows of a partition with the given ids: only their row groups (by their
+    statistics) and columns are read."""
+    path = paths.pixel_catalog_file(
+        catalog.catalog_base_dir, pixel, npix_suffix=catalog.catalog_info.npix_suffix
     )
+    return npd.read_parquet(path, columns=columns, filters=[(id_column, "in", ids)])
+
+
+def load_many(ids, hats_path, lc_object_type="object", columns=None, filter=True, cache=LC_CACHE):
+    """Objects and their light curves (as "lc"), by id.
+
+    The ids are first looked up in the cache (None to bypass it). The others
+    are resolved to their partitions through the index of the collection,
+    and every partition holding some of them is read once. The objects are in
+    the order of the ids; ids which are not found are left out.
+    """
+    spec = OBJECT_TYPES[lc_object_type]
+    id_column, lc_column = spec["id_column"], spec["lc_column"]
+    collection_path = hats_path / spec["collection"]
+    version = catalog_version(collection_path)
+    if columns is not None:
+        columns = list(dict.fromkeys([id_column, *columns, lc_column]))
+
+    requested = ids = list(dict.fromkeys(ids))
+    frames = []
+    if cache is not None:
+        collection_dir = cache.collection_dir(collection_path, version)
+        frames, ids = cache.get(collection_dir, ids, filter, columns)
+    if ids:
+        catalog, index_catalog = open_collection(collection_path, id_column, version)
+        ids_by_pixel = locate_ids(index_catalog, ids)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            loaded = list(executor.map(
+                lambda pixel: read_partition_rows(
+                    catalog, pixel, id_column, ids_by_pixel[pixel], columns
+                ),
+                ids_by_pixel,
+            ))
+        if loaded:
+            ndf = npd.NestedFrame(pd.concat(loaded))
+            ndf = ndf.rename(columns={lc_column: "lc"})
+            if filter:
+                ndf = ndf.query(LC_QUALITY_QUERY)
+            if cache is not None:
+                cache.put(collection_dir, ndf, id_column, filter, columns)
+            frames.append(ndf)
+    if not frames:
+        return npd.NestedFrame()
+    ndf = npd.NestedFrame(pd.concat(frames))
+    # In the order of the ids, whether cached or loaded
+    order = pd.Index(requested).get_indexer(ndf[id_column].to_numpy())
+    ndf = ndf.iloc[np.argsort(order, kind="stable")]
+    if SPATIAL_INDEX_COLUMN in ndf.columns:
+        ndf = ndf.set_index(SPATIAL_INDEX_COLUMN)
+    return ndf
+
+
+def load_object_and_forced(oid, hats_path, filter=True, columns=None):
+    ndf = load_many([oid], hats_path, "object", columns=columns, filter=filter)
+    return ndf.iloc[0]
 
-    ndf = catalog.compute()
-    if filter:
-        ndf = ndf.query(
-            "~lc.psfFlux_flag"
-            " and ~lc.pixelFlags_suspect"
-            " and ~lc.pixelFlags_saturated"
-            " and ~lc.pixelFlags_cr"
-            " and ~lc.pixelFlags_bad"
-        )
+
+def load_dia_object_and_forced(oid, hats_path, filter=True, columns=None):
+    ndf = load_many([oid], hats_path, "dia_object", columns=columns, filter=filter)
     return ndf.iloc[0]
 
 
@@ -236,34 +712,43 @@ def light_curve_plotly_figure(data, *, image_type):
     return lc_fig
 
 
-def cutout_plotly_figure(image):
+def cutout_plotly_figure(image, shapes=None, title=None):
+    height, width = image.shape[:2]
     return go.FigureWidget(
         data=[go.Image(z=image)],
         layout=dict(
             width=800,
             height=800,
+            title=dict(text=title),
+            shapes=shapes or [],
             xaxis=dict(
                 visible=False,  # Hide x-axis
                 showgrid=False,  # Remove grid
                 zeroline=False,
-                showticklabels=False
+                showticklabels=False,
+                range=[-0.5, width - 0.5],  # Clip the overlays to the image
             ),
             yaxis=dict(
                 visible=False,  # Hide y-axis
                 showgrid=False,  # Remove grid
                 zeroline=False,
-                showticklabels=False
+                showticklabels=False,
+                range=[height - 0.5, -0.5],
             ),
-            margin=dict(l=0, r=0, t=0, b=0)  # Remove any margins
+            margin=dict(l=0, r=0, t=0 if title is None else 60, b=0)  # Remove any margins
         )
     )
 
 
-def make_figure(oid, butler, hats_path, image_size=100, lc_object_type="object", image_type="direct"):
+def make_figure(oid, butler, hats_path, image_size=100, lc_object_type="object", image_type="direct", render="array"):
     if lc_object_type == "object":
-        data = load_object_and_forced(oid, hats_path)
+        data = load_object_and_forced(
+            oid, hats_path, columns=OBJECT_TYPES["object"]["figure_columns"]
+        )
     elif lc_object_type == "dia_object":
-        data = load_dia_object_and_forced(oid, hats_path)
+        data = load_dia_object_and_forced(
+            oid, hats_path, columns=OBJECT_TYPES["dia_object"]["figure_columns"]
+        )
         data["coord_ra"] = data["ra"]
         data["coord_dec"] = data["dec"]
         data["objectId"] = data["diaObjectId"]
@@ -276,11 +761,21 @@ def make_figure(oid, butler, hats_path, image_size=100, lc_object_type="object",
     # Text about selection
     out_text = Output()
     
-    @lru_cache(maxsize=4098)
+    # Cutouts of all the epochs are rendered in the background, ahead of clicks
+    cutouts = cutout_service(butler)
+    cutouts.prefetch(
+        lc,
+        ra=data.coord_ra,
+        dec=data.coord_dec,
+        size=image_size,
+        reproject_wcs=wcs,
+        image_type=image_type,
+        render=render,
+    )
+
     def get_image_by_idx(idx):
         row = lc.iloc[idx]
-        image = plot_cutout(
-            butler,
+        rendered = cutouts.image(
             visit_id=row.visit,
             detector_id=row.detector,
             ra=data.coord_ra,
@@ -288,8 +783,9 @@ def make_figure(oid, butler, hats_path, image_size=100, lc_object_type="object",
             size=image_size,
             reproject_wcs=wcs,
             image_type=image_type,
+            render=render,
         )
-        return image
+        return rendered
 
     def update_text_by_idx(idx):
         row = lc.iloc[idx]
@@ -306,8 +802,8 @@ def make_figure(oid, butler, hats_path, image_size=100, lc_object_type="object",
         display(lc_fig)
 
     # Cutout
-    image = get_image_by_idx(0)
-    cutout_fig = cutout_plotly_figure(image)
+    rendered = get_image_by_idx(0)
+    cutout_fig = cutout_plotly_figure(rendered.array, shapes=rendered.shapes, title=rendered.title)
     out_cutout_fig = Output()
     with out_cutout_fig:
         display(cutout_fig)
@@ -322,8 +818,11 @@ def make_figure(oid, butler, hats_path, image_size=100, lc_object_type="object",
         
         update_text_by_idx(idx)
         
-        image = get_image_by_idx(idx)
-        cutout_fig.data[0].z = image
+        rendered = get_image_by_idx(idx)
+        with cutout_fig.batch_update():
+            cutout_fig.data[0].z = rendered.array
+            cutout_fig.layout.shapes = rendered.shapes
+            cutout_fig.layout.title.text = rendered.title
 
     lc_fig.data[0].on_click(update_image)
     